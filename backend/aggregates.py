@@ -0,0 +1,114 @@
+# aggregates.py - Running rating aggregates for fountains
+
+from typing import Optional
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import Fountain, FountainStats, Review
+
+# Optional per-aspect ratings kept alongside the general rating
+ASPECTS = ("temp", "stream", "quenching")
+HISTOGRAM_BUCKETS = range(1, 6)
+
+
+def review_deltas(review: Review, sign: int = 1) -> dict:
+    """Column increments contributed by one review (negative to remove it)."""
+    deltas = {
+        "general_sum": sign * review.general_rating,
+        "general_count": sign,
+        f"general_{review.general_rating}": sign,
+    }
+    for aspect in ASPECTS:
+        rating = getattr(review, f"{aspect}_rating")
+        if rating is not None:
+            deltas[f"{aspect}_sum"] = sign * rating
+            deltas[f"{aspect}_count"] = sign
+    return deltas
+
+
+def apply_review(db: Session, fountain: Fountain, review: Review, sign: int = 1) -> FountainStats:
+    """Add (or with sign=-1 remove) a review's ratings in one atomic upsert.
+
+    The increments are done by SQLite itself, so concurrent writers never
+    lose updates, and the cost does not depend on how many reviews exist.
+    The fountain's denormalised average and count are refreshed from the
+    returned totals.
+    """
+    deltas = review_deltas(review, sign)
+    table = FountainStats.__table__
+    statement = insert(table).values(fountain_id=fountain.id, **deltas)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.fountain_id],
+        set_={name: table.c[name] + statement.excluded[name] for name in deltas},
+    ).returning(*table.c)
+    stats = FountainStats(**db.execute(statement).one()._asdict())
+
+    fountain.number_of_ratings = stats.general_count
+    fountain.average_general_rating = average(stats.general_sum, stats.general_count) or 0.0
+    return stats
+
+
+def average(total: int, count: int) -> Optional[float]:
+    return total / count if count else None
+
+
+def stats_summary(stats: Optional[FountainStats]) -> dict:
+    """Averages, counts and histogram for API responses."""
+    if stats is None:
+        stats = FountainStats()
+    summary = {
+        "general": {
+            "average": average(stats.general_sum, stats.general_count),
+            "count": stats.general_count,
+            "histogram": {str(b): getattr(stats, f"general_{b}") for b in HISTOGRAM_BUCKETS},
+        }
+    }
+    for aspect in ASPECTS:
+        total, count = getattr(stats, f"{aspect}_sum"), getattr(stats, f"{aspect}_count")
+        summary[aspect] = {"average": average(total, count), "count": count}
+    return summary
+
+
+def recompute_all(db: Session) -> int:
+    """Rebuild every fountain's aggregates from the reviews in bulk.
+
+    Repairs any drift between the running totals and the Review table.
+    Returns the number of fountains with reviews.
+    """
+    columns = {
+        "general_sum": func.sum(Review.general_rating),
+        "general_count": func.count(),
+    }
+    for aspect in ASPECTS:
+        rating = getattr(Review, f"{aspect}_rating")
+        columns[f"{aspect}_sum"] = func.coalesce(func.sum(rating), 0)
+        columns[f"{aspect}_count"] = func.count(rating)
+    for bucket in HISTOGRAM_BUCKETS:
+        columns[f"general_{bucket}"] = func.sum(case((Review.general_rating == bucket, 1), else_=0))
+
+    rows = db.execute(
+        select(Review.fountain_id.label("fountain_id"), *(c.label(n) for n, c in columns.items()))
+        .group_by(Review.fountain_id)
+    ).mappings().all()
+
+    db.query(FountainStats).delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(FountainStats.__table__), [dict(row) for row in rows])
+
+    # Fountains without reviews fall back to zero
+    db.query(Fountain).update(
+        {Fountain.average_general_rating: 0.0, Fountain.number_of_ratings: 0},
+        synchronize_session=False,
+    )
+    if rows:
+        db.execute(update(Fountain), [
+            {
+                "id": row["fountain_id"],
+                "average_general_rating": row["general_sum"] / row["general_count"],
+                "number_of_ratings": row["general_count"],
+            }
+            for row in rows
+        ])
+    return len(rows)
@@ -1,10 +1,15 @@
 # auth.py - JWT Authentication utilities
 
+import asyncio
 from datetime import datetime, timedelta
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
 import os
+import threading
+import time
 
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -12,6 +17,7 @@ from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
 from models import User, TokenData
+from cache import TTLCache
 
 load_dotenv()
 
@@ -20,21 +26,61 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing; hashes below the configured cost are upgraded on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt runs on its own small pool, awaited from async endpoints, so logins
+# waiting for a hash hold no request thread; past PASSWORD_HASH_QUEUE waiting
+# jobs new ones are refused (503) instead of piling up
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes are already queued."""
+
+# Usernames never change, so listings can share them across requests
+username_cache = TTLCache(max_size=4096, ttl_seconds=300)
+
+# Verified tokens (token -> TokenData), kept no longer than the token is valid
+token_cache = TTLCache(max_size=4096, ttl_seconds=300)
+
+# Detached User snapshots by ID; dropped by commit hooks whenever a user row changes
+user_cache = TTLCache(max_size=2048, ttl_seconds=60)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def _run_hashing(fn, *args):
+    """Run a bcrypt call on the hashing pool and await its result."""
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        future = _hash_pool.submit(fn, *args)
+    except BaseException:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return await asyncio.wrap_future(future)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    return await _run_hashing(pwd_context.verify, plain_password, hashed_password)
+
 
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password; also returns a new hash if the stored one is below the current cost."""
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
 
-def get_password_hash(password: str) -> str:
+
+async def get_password_hash(password: str) -> str:
     """Hash a password."""
-    return pwd_context.hash(password)
+    return await _run_hashing(pwd_context.hash, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -44,22 +90,28 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # JWT requires "sub" to be a string
+    to_encode.update({"sub": str(to_encode["sub"]), "exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
 def decode_token(token: str) -> Optional[TokenData]:
-    """Decode and validate a JWT token."""
+    """Decode and validate a JWT token (verified tokens are cached until they expire)."""
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        return token_data
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: int = payload.get("sub")
         username: str = payload.get("username")
         if user_id is None:
             return None
-        return TokenData(user_id=user_id, username=username)
-    except JWTError:
+        token_data = TokenData(user_id=user_id, username=username)
+    except (JWTError, ValueError):
         return None
+    token_cache.set(token, token_data, ttl_seconds=payload["exp"] - time.time())
+    return token_data
 
 
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
@@ -77,13 +129,63 @@ def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
     return db.query(User).filter(User.id == user_id).first()
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    """Authenticate a user by email and password."""
-    user = get_user_by_email(db, email)
+def get_cached_user(db: Session, user_id: int) -> Optional[User]:
+    """Get a user by ID from the snapshot cache, querying only on a miss.
+
+    The snapshot is detached from any session and shared between requests,
+    so callers must treat it as read-only.
+    """
+    user = user_cache.get(user_id)
+    if user is None:
+        row = get_user_by_id(db, user_id)
+        if row is None:
+            return None
+        user = User.model_validate(row)
+        user_cache.set(user_id, user)
+    return user
+
+
+def invalidate_users(user_ids: Iterable[int]):
+    """Forget cached snapshots of users that were updated or deleted."""
+    for user_id in user_ids:
+        user_cache.delete(user_id)
+
+
+def auth_cache_stats() -> dict:
+    return {"tokens": token_cache.stats(), "users": user_cache.stats()}
+
+
+def get_usernames(db: Session, user_ids: Iterable[Optional[int]]) -> Dict[int, str]:
+    """Map user IDs to usernames with at most one query for the uncached ones."""
+    wanted = {user_id for user_id in user_ids if user_id is not None}
+    usernames = username_cache.get_many(wanted)
+    missing = wanted - usernames.keys()
+    if missing:
+        for user_id, username in db.query(User.id, User.username).filter(User.id.in_(missing)):
+            username_cache.set(user_id, username)
+            usernames[user_id] = username
+    return usernames
+
+
+def _store_password_hash(db: Session, user: User, password_hash: str):
+    user.password_hash = password_hash
+    db.commit()
+    db.refresh(user)
+
+
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
+    """Authenticate a user by email and password, rehashing outdated hashes.
+
+    Database work runs on the request threadpool; bcrypt is awaited on its own pool.
+    """
+    user = await run_in_threadpool(get_user_by_email, db, email)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    verified, new_hash = await verify_and_update_password(password, user.password_hash)
+    if not verified:
         return None
+    if new_hash is not None:
+        await run_in_threadpool(_store_password_hash, db, user, new_hash)
     return user
 
 
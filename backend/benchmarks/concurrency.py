@@ -0,0 +1,61 @@
+# concurrency.py - Concurrent-request throughput against a running Berez API
+#
+# Usage:
+#   python main.py                      # in another terminal (after /populate)
+#   python benchmarks/concurrency.py --concurrency 32 --requests 2000
+
+import argparse
+import json
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PATHS = [
+    "/fountains/34.78,32.08?limit=50",
+    "/fountains/1/detail",
+    "/reviews/1",
+]
+
+
+def fetch(url: str) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def run(base_url: str, paths, concurrency: int, total: int) -> dict:
+    urls = [base_url + paths[i % len(paths)] for i in range(total)]
+    # Warm up connections, caches and the spatial index
+    for url in urls[: len(paths)]:
+        fetch(url)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(fetch, urls))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure concurrent-request throughput")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", action="append", help="Path to request (repeatable)")
+    parser.add_argument("--concurrency", type=int, action="append", help="Client threads (repeatable)")
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency or [1, 8, 32]:
+        print(json.dumps(run(args.url, args.path or DEFAULT_PATHS, concurrency, args.requests)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# generate_data.py - Synthetic Berez dataset for benchmarks
+#
+# Usage (from backend/):
+#   python benchmarks/generate_data.py /tmp/berez-bench                      # bundled CSV size
+#   python benchmarks/generate_data.py /tmp/berez-bench --fountains 1000000 --reviews 5000000
+#
+# Writes DATA_DIR/berez.db and DATA_DIR/uploads/, laid out like a local
+# checkout, so the app (or benchmarks/suite.py) can run with DATA_DIR as
+# its working directory.
+
+import argparse
+import csv
+import io
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from sqlmodel import SQLModel  # noqa: E402
+
+from aggregates import ASPECTS, recompute_all  # noqa: E402
+from auth import pwd_context  # noqa: E402
+from database import create_sqlite_engines  # noqa: E402
+from importer import parse_row  # noqa: E402
+from models import Fountain, Photo, Review, User  # noqa: E402
+from spatial import grid_cell  # noqa: E402
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BATCH_SIZE = 10000
+# Every generated user can log in with this password
+USER_PASSWORD = "benchmark"
+PHOTO_FILENAME = "benchmark.jpg"
+# Copies of the bundled city are tiled this far apart (degrees), 20 per row
+CITY_SPACING = 0.3
+CITIES_PER_ROW = 20
+# Higher values concentrate reviews and photos on fewer (low id) fountains
+POPULARITY_SKEW = 3
+REVIEW_TEXTS = [None, None, "Cold water", "Good pressure", "Broken handle", "Great for dogs"]
+
+
+def _batches(rows, size=BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _popular_fountain(rng: random.Random, fountains: int) -> int:
+    return int(fountains * rng.random() ** POPULARITY_SKEW) + 1
+
+
+def load_city(csv_path: Path) -> list:
+    now = datetime.now()
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        return [parse_row(row, now) for row in csv.DictReader(f)]
+
+
+def fountain_rows(city: list, count: int, rng: random.Random):
+    """The bundled city first, then jittered copies of it tiled as further cities."""
+    for i in range(count):
+        copy, base = divmod(i, len(city))
+        row = dict(city[base], id=i + 1)
+        if copy:
+            row["longitude"] += (copy % CITIES_PER_ROW) * CITY_SPACING + rng.uniform(-0.002, 0.002)
+            row["latitude"] += (copy // CITIES_PER_ROW) * CITY_SPACING + rng.uniform(-0.002, 0.002)
+            row["grid_cell"] = grid_cell(row["longitude"], row["latitude"])
+        yield row
+
+
+def user_rows(count: int):
+    password_hash = pwd_context.hash(USER_PASSWORD)
+    created_at = datetime.now()
+    for i in range(1, count + 1):
+        yield {
+            "id": i, "username": f"bench{i}", "name": f"Bench User {i}",
+            "email": f"bench{i}@example.com", "password_hash": password_hash,
+            "created_at": created_at, "is_active": True,
+        }
+
+
+def review_rows(count: int, fountains: int, users: int, rng: random.Random):
+    now = datetime.now()
+    for _ in range(count):
+        row = {
+            "fountain_id": _popular_fountain(rng, fountains),
+            "user_id": rng.randint(1, users) if users and rng.random() < 0.8 else None,
+            "creation_date": now - timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60)),
+            "general_rating": rng.randint(1, 5),
+            "description": rng.choice(REVIEW_TEXTS),
+        }
+        for aspect in ASPECTS:
+            row[f"{aspect}_rating"] = rng.randint(1, 5) if rng.random() < 0.5 else None
+        yield row
+
+
+def photo_rows(count: int, fountains: int, users: int, file_size: int, rng: random.Random):
+    now = datetime.now()
+    for _ in range(count):
+        yield {
+            "filename": PHOTO_FILENAME, "original_filename": "photo.jpg",
+            "content_type": "image/jpeg", "file_size": file_size, "status": "ready",
+            "uploaded_by": rng.randint(1, users) if users and rng.random() < 0.8 else None,
+            "fountain_id": _popular_fountain(rng, fountains),
+            "created_at": now - timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60)),
+        }
+
+
+def sample_photo() -> bytes:
+    """A small JPEG for photo rows and upload scenarios."""
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", (640, 480), (40, 120, 200)).save(out, "JPEG", quality=80)
+    return out.getvalue()
+
+
+def generate(
+    data_dir: Path,
+    fountains: int,
+    reviews: int,
+    photos: int,
+    users: int,
+    seed: int = 0,
+    csv_path: Path = BACKEND_DIR / "fountains.csv",
+) -> dict:
+    """Create DATA_DIR/berez.db filled with reproducible synthetic data."""
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    db_path = data_dir / "berez.db"
+    if db_path.exists():
+        raise FileExistsError(f"{db_path} already exists")
+    uploads = data_dir / "uploads"
+    uploads.mkdir(exist_ok=True)
+    photo = sample_photo()
+    (uploads / PHOTO_FILENAME).write_bytes(photo)
+
+    engine, _ = create_sqlite_engines(f"sqlite:///{db_path}")
+    SQLModel.metadata.create_all(engine)
+    tables = [
+        (User, user_rows(users)),
+        (Fountain, fountain_rows(load_city(csv_path), fountains, rng)),
+        (Review, review_rows(reviews, fountains, users, rng)),
+        (Photo, photo_rows(photos, fountains, users, len(photo), rng)),
+    ]
+    with Session(engine) as db:
+        for model, rows in tables:
+            for batch in _batches(rows):
+                db.execute(insert(model.__table__), batch)
+        recompute_all(db)
+        db.commit()
+    engine.dispose()
+
+    return {
+        "path": str(db_path),
+        "seed": seed,
+        "fountains": fountains,
+        "reviews": reviews,
+        "photos": photos,
+        "users": users,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Berez dataset")
+    parser.add_argument("data_dir", type=Path)
+    parser.add_argument("--fountains", type=int, default=394, help="Default: the bundled fountains.csv")
+    parser.add_argument("--reviews", type=int, help="Default: 10 per fountain")
+    parser.add_argument("--photos", type=int, help="Default: 1 per fountain")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = generate(
+        args.data_dir,
+        args.fountains,
+        args.fountains * 10 if args.reviews is None else args.reviews,
+        args.fountains if args.photos is None else args.photos,
+        args.users,
+        args.seed,
+    )
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# sqlite_profiles.py - Read/write throughput of each SQLite engine profile
+#
+# Usage (from backend/):
+#   python benchmarks/sqlite_profiles.py --readers 8 --writers 2 --seconds 5
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import func  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlmodel import SQLModel  # noqa: E402
+
+from database import SQLITE_PROFILES, RoutingSession, create_sqlite_engines  # noqa: E402
+from models import Fountain, FountainType, Review  # noqa: E402
+
+
+def seed(session_factory, fountains: int, reviews: int):
+    with session_factory() as db:
+        db.add_all(
+            Fountain(
+                id=i, address=f"Street {i}", latitude=32.0 + i * 1e-4, longitude=34.7 + i * 1e-4,
+                dog_friendly=False, type=FountainType.cylindrical_fountain,
+            )
+            for i in range(1, fountains + 1)
+        )
+        db.add_all(
+            Review(fountain_id=random.randint(1, fountains), general_rating=random.randint(1, 5))
+            for _ in range(reviews)
+        )
+        db.commit()
+
+
+def read_once(db, fountains: int):
+    fountain_id = random.randint(1, fountains)
+    db.get(Fountain, fountain_id)
+    db.query(func.count(Review.id), func.avg(Review.general_rating)).filter(
+        Review.fountain_id == fountain_id
+    ).one()
+    db.expunge_all()
+
+
+def write_once(db, fountains: int):
+    db.add(Review(fountain_id=random.randint(1, fountains), general_rating=random.randint(1, 5)))
+    db.commit()
+
+
+def run(profile: str, readers: int, writers: int, seconds: float, fountains: int, reviews: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, read_engine = create_sqlite_engines(
+            f"sqlite:///{Path(tmp) / 'bench.db'}", profile, readers + writers
+        )
+        SQLModel.metadata.create_all(engine)
+        session_factory = sessionmaker(class_=RoutingSession, bind=engine, read_bind=read_engine)
+        seed(session_factory, fountains, reviews)
+
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+        stop = time.perf_counter() + seconds
+
+        def worker(kind, step):
+            done = errors = 0
+            with session_factory() as db:
+                while time.perf_counter() < stop:
+                    try:
+                        step(db, fountains)
+                        done += 1
+                    except Exception:
+                        # e.g. "database is locked" with the rollback journal
+                        db.rollback()
+                        errors += 1
+            with lock:
+                counts[kind] += done
+                counts["errors"] += errors
+
+        threads = [threading.Thread(target=worker, args=("reads", read_once)) for _ in range(readers)]
+        threads += [threading.Thread(target=worker, args=("writes", write_once)) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+        if read_engine is not None:
+            read_engine.dispose()
+
+    return {
+        "profile": profile,
+        "readers": readers,
+        "writers": writers,
+        "reads_per_second": round(counts["reads"] / seconds, 1),
+        "writes_per_second": round(counts["writes"] / seconds, 1),
+        "errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SQLite engine profiles")
+    parser.add_argument("--profile", action="append", choices=sorted(SQLITE_PROFILES), help="Profile (repeatable)")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--fountains", type=int, default=2000)
+    parser.add_argument("--reviews", type=int, default=20000)
+    args = parser.parse_args()
+
+    for profile in args.profile or sorted(SQLITE_PROFILES):
+        print(json.dumps(run(profile, args.readers, args.writers, args.seconds, args.fountains, args.reviews)))
+
+
+if __name__ == "__main__":
+    main()
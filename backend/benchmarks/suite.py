@@ -0,0 +1,309 @@
+# suite.py - Backend benchmark suite: frontend-like scenarios, latency percentiles, baselines
+#
+# Usage (from backend/):
+#   python benchmarks/suite.py --data-dir /tmp/berez-bench --save baseline.json
+#   ... change code ...
+#   python benchmarks/suite.py --data-dir /tmp/berez-bench --compare baseline.json
+#
+# The dataset is generated on first use (see generate_data.py for sizes).
+# By default the app runs in-process on a fresh copy of DATA_DIR/berez.db
+# with local uploads, and queries per request are counted. With --url the
+# scenarios hit a running server instead, e.g.
+#   cd /tmp/berez-bench && uvicorn main:app --app-dir /path/to/backend
+# --strict turns on QUERY_BUDGET_STRICT, so any request running more
+# queries than its route's @query_budget fails and counts as an error.
+# Needs httpx (FastAPI's TestClient is built on it).
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Generated users and in-process logins should measure the app, not the
+# production password cost (read when auth is first imported)
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import generate_data  # noqa: E402
+
+# Share of requests per scenario in "frontend_mix", after the app's own pages:
+# the map loads nearby fountains, a tap opens the detail page, and so on
+FRONTEND_MIX = {
+    "read_fountains": 50,
+    "fountain_detail": 25,
+    "read_reviews": 8,
+    "auth_me": 10,
+    "create_review": 5,
+    "upload_photo": 2,
+}
+# Relative change in a latency percentile or throughput that counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+class Context:
+    """Things scenarios pick from: sampled fountains, a logged-in user, a photo."""
+
+    def __init__(self, data_dir: Path, client, seed: int):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        with sqlite3.connect(data_dir / "berez.db") as conn:
+            self.fountains = conn.execute(
+                "SELECT id, longitude, latitude FROM fountain ORDER BY random() LIMIT 2000"
+            ).fetchall()
+        self.photo = generate_data.sample_photo()
+        response = client.post("/auth/login", json={
+            "email": "bench1@example.com", "password": generate_data.USER_PASSWORD,
+        })
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def fountain(self):
+        with self.lock:
+            return self.rng.choice(self.fountains)
+
+    def choice(self, names, weights):
+        with self.lock:
+            return self.rng.choices(names, weights)[0]
+
+
+def read_fountains(client, ctx):
+    _, longitude, latitude = ctx.fountain()
+    return client.get(f"/fountains/{longitude},{latitude}")
+
+
+def fountain_detail(client, ctx):
+    fountain_id, _, _ = ctx.fountain()
+    return client.get(f"/fountains/{fountain_id}/detail?fields=fountain,reviews,photos")
+
+
+def read_reviews(client, ctx):
+    fountain_id, _, _ = ctx.fountain()
+    return client.get(f"/reviews/{fountain_id}")
+
+
+def auth_me(client, ctx):
+    return client.get("/auth/me", headers=ctx.headers)
+
+
+def create_review(client, ctx):
+    fountain_id, _, _ = ctx.fountain()
+    return client.post("/review", headers=ctx.headers, json={
+        "fountain_id": fountain_id, "general_rating": 4, "temp_rating": 5, "description": "benchmark",
+    })
+
+
+def upload_photo(client, ctx):
+    fountain_id, _, _ = ctx.fountain()
+    return client.post(
+        f"/photos/upload?fountain_id={fountain_id}", headers=ctx.headers,
+        files={"file": ("benchmark.jpg", ctx.photo, "image/jpeg")},
+    )
+
+
+def frontend_mix(client, ctx):
+    name = ctx.choice(list(FRONTEND_MIX), list(FRONTEND_MIX.values()))
+    return SCENARIOS[name](client, ctx)
+
+
+SCENARIOS = {
+    "read_fountains": read_fountains,
+    "fountain_detail": fountain_detail,
+    "read_reviews": read_reviews,
+    "auth_me": auth_me,
+    "create_review": create_review,
+    "upload_photo": upload_photo,
+    "frontend_mix": frontend_mix,
+}
+
+
+def percentile(ordered, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class QueryCounter:
+    """Counts SQL statements run by the in-process app's engines."""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._record)
+
+    def _record(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def run_scenario(name, client, ctx, requests, concurrency, warmup, counter=None, settle=None) -> dict:
+    scenario = SCENARIOS[name]
+    for _ in range(warmup):
+        scenario(client, ctx)
+    if settle:
+        settle()
+
+    failures = []
+
+    def timed(_):
+        started = time.perf_counter()
+        response = scenario(client, ctx)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            failures.append(response.status_code)
+        return elapsed
+
+    queries_before = counter.count if counter else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed, range(requests)))
+    # Background work (photo variants) belongs to the requests that caused it
+    if settle:
+        settle()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": len(failures),
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "queries_per_request": (
+            round((counter.count - queries_before) / requests, 2) if counter else None
+        ),
+    }
+
+
+def in_process_app(data_dir: Path):
+    """Import the app on a fresh copy of the dataset; returns (client, counter, settle).
+
+    Write scenarios add rows, so every run starts from DATA_DIR/run, a copy
+    of the generated database and uploads, to keep runs comparable.
+    """
+    run_dir = data_dir / "run"
+    shutil.rmtree(run_dir, ignore_errors=True)
+    run_dir.mkdir()
+    shutil.copy(data_dir / "berez.db", run_dir / "berez.db")
+    shutil.copytree(data_dir / "uploads", run_dir / "uploads")
+    os.chdir(run_dir)
+    from fastapi.testclient import TestClient
+    import main
+
+    engines = [engine for engine in (main.engine, main.read_engine) if engine is not None]
+    return TestClient(main.app), QueryCounter(engines), main.wait_for_background_work
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print each metric against the baseline; returns True if nothing regressed."""
+    # (metric, True if bigger is better)
+    metrics = [("p50_ms", False), ("p95_ms", False), ("p99_ms", False),
+               ("throughput_rps", True), ("queries_per_request", False)]
+    ok = True
+    for name, current in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print(f"{name}: not in baseline")
+            continue
+        parts = []
+        for metric, higher_is_better in metrics:
+            old, new = before.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            if metric == "queries_per_request":
+                # Query counts barely vary between runs, so flag even small increases
+                regressed = new > old * 1.05 + 0.01
+            else:
+                regressed = -change > tolerance if higher_is_better else change > tolerance
+            ok = ok and not regressed
+            parts.append(f"{metric} {old} -> {new} ({change:+.0%}){' REGRESSION' if regressed else ''}")
+        print(f"{name}: " + ", ".join(parts))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Berez backend benchmark suite")
+    parser.add_argument("--data-dir", type=Path, required=True, help="Dataset directory (generated if missing)")
+    parser.add_argument("--fountains", type=int, default=394, help="Dataset size when generating")
+    parser.add_argument("--reviews", type=int, help="Default: 10 per fountain")
+    parser.add_argument("--photos", type=int, help="Default: 1 per fountain")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario (repeatable)")
+    parser.add_argument("--requests", type=int, default=300, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", type=Path, help="Write results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--strict", action="store_true", help="Fail requests over their query budget (in-process only)")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir.resolve()
+    if not (data_dir / "berez.db").exists():
+        print(json.dumps(generate_data.generate(
+            data_dir, args.fountains,
+            args.fountains * 10 if args.reviews is None else args.reviews,
+            args.fountains if args.photos is None else args.photos,
+            users=1000, seed=args.seed,
+        )))
+
+    counter = settle = None
+    if args.url:
+        import httpx
+
+        client = httpx.Client(base_url=args.url, timeout=60)
+    else:
+        if args.strict:
+            os.environ["QUERY_BUDGET_STRICT"] = "1"
+        client, counter, settle = in_process_app(data_dir)
+
+    ctx = Context(data_dir, client, args.seed)
+    with sqlite3.connect(data_dir / "berez.db") as conn:
+        dataset = {
+            table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+            for table in ("fountain", "review", "photo", "user")
+        }
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "mode": args.url or "in-process",
+        "python": platform.python_version(),
+        "dataset": dataset,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "scenarios": {},
+    }
+    for name in args.scenario or list(SCENARIOS):
+        results["scenarios"][name] = run_scenario(
+            name, client, ctx, args.requests, args.concurrency, args.warmup, counter, settle
+        )
+        print(json.dumps({"scenario": name, **results["scenarios"][name]}))
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if baseline.get("dataset") != dataset:
+            print(f"Warning: baseline dataset {baseline.get('dataset')} differs from {dataset}")
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    if args.strict and any(result["errors"] for result in results["scenarios"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
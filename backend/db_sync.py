@@ -0,0 +1,472 @@
+# db_sync.py - S3 snapshot sync for the SQLite database on Lambda
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# How long the uploader waits for more commits before taking a snapshot
+UPLOAD_DEBOUNCE_SECONDS = 0.05
+UPLOAD_ATTEMPTS = 3
+# Times a conflicting upload is re-based on a newer S3 version before giving up
+MERGE_ATTEMPTS = 5
+# How long to wait for local writers when locking the database for a snapshot
+LOCK_TIMEOUT_SECONDS = 30
+
+# Large databases are fetched as parallel ranged GETs of this size
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CONCURRENCY = 8
+
+# Only data changes are logged for replay; the schema is created by the app itself
+_LOGGED_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# Row ids handed out on Lambda: milliseconds since ID_EPOCH_MS followed by a
+# random per-instance tag, so two instances never insert the same id and
+# replayed rows keep the ids the client was given (53 bits, safe in JSON)
+ID_EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+ID_TAG_BITS = 12
+
+# S3 error codes for a conditional write that lost the race
+_CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+
+class NotModified(Exception):
+    """The S3 object still matches the local copy."""
+
+
+def _remove_sidecars(path: Path):
+    """Delete a database's WAL and shared-memory files.
+
+    A WAL left behind next to a replaced database file would be replayed
+    into it on the next open, so they must go whenever the file is swapped.
+    """
+    for suffix in ("-wal", "-shm"):
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def _error_code(error: Exception) -> Optional[str]:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code")
+
+
+class RowIds:
+    """Row ids no other instance (or region shard) will generate, increasing per instance."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tag = secrets.randbelow(1 << ID_TAG_BITS)
+        self._last_ms = 0
+
+    def new_id(self) -> int:
+        with self._lock:
+            ms = max(int(time.time() * 1000) - ID_EPOCH_MS, self._last_ms + 1)
+            self._last_ms = ms
+        return (ms << ID_TAG_BITS) | self._tag
+
+    def assign_id(self, mapper, connection, target):
+        """before_insert listener giving new rows an id from new_id()."""
+        if target.id is None:
+            target.id = self.new_id()
+
+
+class DatabaseSync:
+    """Keeps the S3 copy of the SQLite database in step with local commits.
+
+    Commits only mark the database dirty. A background thread takes a
+    consistent snapshot (SQLite backup API) and uploads it, so a burst of
+    commits is coalesced into a single PUT and requests that did not write
+    never touch S3.
+
+    Uploads are conditional on the S3 ETag the local copy is based on, so
+    several Lambda instances can write concurrently. Every committed write
+    statement is kept in a local change log until it has been uploaded; when
+    another instance got there first, the newer object is downloaded, the
+    log is replayed on top of it and the result is uploaded instead.
+
+    Replaying raw statements is only sound if the ids they mention mean the
+    same rows on every instance, so inserted rows take their id from
+    new_id() rather than SQLite's autoincrement. Denormalised columns that
+    were written as absolute values are re-derived by `on_replay`.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable,
+        bucket: str,
+        key: str,
+        path: Path,
+        debounce_seconds: float = UPLOAD_DEBOUNCE_SECONDS,
+        on_reload: Optional[Callable[[], None]] = None,
+        on_upload: Optional[Callable[[float, bool], None]] = None,
+        on_replay: Optional[Callable[[Path], None]] = None,
+    ):
+        self.client_factory = client_factory
+        self.bucket = bucket
+        self.key = key
+        self.path = path
+        self.debounce_seconds = debounce_seconds
+        # Called after the local database was replaced by a merged S3 version
+        self.on_reload = on_reload
+        # Called with (seconds, succeeded) after every upload attempt cycle
+        self.on_upload = on_upload
+        # Called with a database file after the change log was replayed into it
+        self.on_replay = on_replay
+        self._cond = threading.Condition()
+        self._generation = 0  # bumped on every committed write
+        self._attempted = 0   # last generation an upload was attempted for
+        self._worker: Optional[threading.Thread] = None
+        # Sidecar recording which S3 object version the local file came from
+        self.meta_path = path.with_name(path.name + ".meta")
+        # Phase timings (ms) and outcome of the last download, for cold start logs
+        self.download_stats: dict = {}
+        # Committed write transactions not yet uploaded, mirrored to disk
+        self.log_path = path.with_name(path.name + ".changes")
+        self._log_lock = threading.Lock()
+        self._log: List[list] = self._read_log()
+        self.ids = RowIds()
+
+    # ---------- row ids ----------
+
+    def new_id(self) -> int:
+        """A row id no other instance will generate (increasing per instance)."""
+        return self.ids.new_id()
+
+    def assign_id(self, mapper, connection, target):
+        """before_insert listener giving new rows an id from new_id()."""
+        self.ids.assign_id(mapper, connection, target)
+
+    # ---------- local metadata ----------
+
+    def _read_meta(self) -> dict:
+        try:
+            return json.loads(self.meta_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, etag: Optional[str], version_id: Optional[str]):
+        self.meta_path.write_text(json.dumps({"etag": etag, "version_id": version_id}))
+
+    def _read_log(self) -> List[list]:
+        try:
+            with open(self.log_path) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError):
+            return []
+
+    def _append_log(self, statements: list):
+        with self._log_lock:
+            self._log.append(statements)
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(statements, default=str) + "\n")
+
+    def _trim_log(self, count: int):
+        """Drop the first `count` transactions once they are safely in S3."""
+        with self._log_lock:
+            self._log = self._log[count:]
+            with open(self.log_path, "w") as f:
+                for statements in self._log:
+                    f.write(json.dumps(statements, default=str) + "\n")
+
+    def track(self, engine: Engine, mark_dirty: bool = False):
+        """Record the write statements of every committed transaction on an engine.
+
+        With `mark_dirty`, those commits also schedule the upload themselves,
+        for callers that cannot tell which database a session wrote to.
+        """
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _record_statement(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip()[:7].upper().startswith(_LOGGED_STATEMENTS):
+                conn.info.setdefault("pending_changes", []).append(
+                    [statement, parameters, executemany]
+                )
+
+        @event.listens_for(engine, "commit")
+        def _log_committed(conn):
+            pending = conn.info.pop("pending_changes", None)
+            if pending:
+                self._append_log(pending)
+                if mark_dirty:
+                    self.mark_dirty()
+
+        @event.listens_for(engine, "rollback")
+        def _drop_rolled_back(conn):
+            conn.info.pop("pending_changes", None)
+
+    # ---------- download ----------
+
+    def _fetch(self, destination: Path, etag: Optional[str] = None) -> dict:
+        """Download the current S3 object to `destination` and return its HEAD.
+
+        Raises NotModified when `etag` is given and still current.
+        """
+        from botocore.exceptions import ClientError
+        from boto3.s3.transfer import TransferConfig
+
+        s3 = self.client_factory()
+        head_args = {"Bucket": self.bucket, "Key": self.key}
+        if etag:
+            head_args["IfNoneMatch"] = etag
+        try:
+            head = s3.head_object(**head_args)
+        except ClientError as e:
+            if _error_code(e) in ("304", "NotModified"):
+                raise NotModified() from e
+            raise
+
+        extra_args = {}
+        version_id = head.get("VersionId")
+        if version_id and version_id != "null":
+            # Pin the download to the version the HEAD described
+            extra_args["VersionId"] = version_id
+        partial = destination.with_name(destination.name + ".download")
+        try:
+            s3.download_file(
+                self.bucket, self.key, str(partial),
+                ExtraArgs=extra_args,
+                Config=TransferConfig(
+                    multipart_threshold=DOWNLOAD_PART_SIZE,
+                    multipart_chunksize=DOWNLOAD_PART_SIZE,
+                    max_concurrency=DOWNLOAD_CONCURRENCY,
+                ),
+            )
+            _remove_sidecars(destination)
+            os.replace(partial, destination)
+        finally:
+            partial.unlink(missing_ok=True)
+        return head
+
+    def download(self):
+        """Fetch the database from S3 unless the local copy is already current.
+
+        A previous sandbox may have left the same object version in /tmp, so
+        the stored ETag is revalidated with a conditional HEAD first. Missing
+        objects leave a fresh database to be created.
+        """
+        stats = self.download_stats = {"cached": False}
+        started = time.perf_counter()
+        meta = self._read_meta() if self.path.exists() else {}
+        try:
+            head = self._fetch(self.path, meta.get("etag"))
+        except NotModified:
+            stats["check_ms"] = _elapsed_ms(started)
+            stats["cached"] = True
+            print(f"Local database at {self.path} matches S3, skipping download")
+            if self._log:
+                # A previous sandbox committed these but never got to upload them
+                self.mark_dirty()
+            return
+        except Exception as e:
+            # Database doesn't exist in S3 yet, will be created fresh
+            print(f"No existing database in S3, will create new: {e}")
+            return
+        self._write_meta(head.get("ETag"), head.get("VersionId"))
+        if self._log:
+            # Commits a previous sandbox never uploaded were lost with the
+            # replaced file; replay them and keep them logged until uploaded
+            self._replay(self.path, self._log)
+            self.mark_dirty()
+        stats["download_ms"] = _elapsed_ms(started)
+        stats["bytes"] = head.get("ContentLength", 0)
+        print(f"Downloaded database from S3 to {self.path}")
+
+    # ---------- upload ----------
+
+    def mark_dirty(self):
+        """Record that a write was committed and schedule an upload."""
+        with self._cond:
+            self._generation += 1
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="db-sync", daemon=True
+                )
+                self._worker.start()
+            self._cond.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every write committed so far has been uploaded (or tried)."""
+        with self._cond:
+            target = self._generation
+            return self._cond.wait_for(lambda: self._attempted >= target, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._generation > self._attempted)
+            # Let a burst of commits land before taking the snapshot
+            time.sleep(self.debounce_seconds)
+            with self._cond:
+                target = self._generation
+            started = time.perf_counter()
+            uploaded = self._upload()
+            if self.on_upload is not None:
+                self.on_upload(time.perf_counter() - started, uploaded)
+            with self._cond:
+                self._attempted = target
+                self._cond.notify_all()
+
+    def _upload(self) -> bool:
+        if not self.path.exists():
+            return False
+
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                if self._push_snapshot() or self._merge_remote():
+                    return True
+            except Exception as e:
+                print(f"Failed to upload database to S3 (attempt {attempt}): {e}")
+                if attempt < UPLOAD_ATTEMPTS:
+                    time.sleep(0.2 * attempt)
+        return False
+
+    def _lock_writers(self) -> sqlite3.Connection:
+        """Take SQLite's write lock so no local commit lands while it is held.
+
+        Readers are unaffected, and the change log cannot grow meanwhile:
+        statements are only logged by transactions that already hold it.
+        """
+        lock = sqlite3.connect(str(self.path), timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None)
+        lock.execute("BEGIN IMMEDIATE")
+        return lock
+
+    def _put(self, source: Path, etag: Optional[str]) -> Optional[dict]:
+        """Upload `source` only if S3 still holds `etag`; None on conflict."""
+        from botocore.exceptions import ClientError
+
+        # Without a known version, only create the object if nobody else has
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            with open(source, "rb") as body:
+                return self.client_factory().put_object(
+                    Bucket=self.bucket, Key=self.key, Body=body, **condition
+                )
+        except ClientError as e:
+            if _error_code(e) in _CONFLICT_CODES:
+                return None
+            raise
+
+    def _push_snapshot(self) -> bool:
+        """Upload a snapshot of the local database on top of the version it came from."""
+        snapshot = self.path.with_name(self.path.name + ".upload")
+        try:
+            lock = self._lock_writers()
+            try:
+                logged = len(self._log)
+                source = sqlite3.connect(str(self.path))
+                target = sqlite3.connect(str(snapshot))
+                try:
+                    # With the write lock held every WAL frame can be folded
+                    # back into the main file, so the backup reads it directly
+                    source.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
+            finally:
+                lock.rollback()
+                lock.close()
+
+            result = self._put(snapshot, self._read_meta().get("etag"))
+            if result is None:
+                print("S3 database changed since our last sync, merging")
+                return False
+            # The local file now holds (at least) this version
+            self._write_meta(result.get("ETag"), result.get("VersionId"))
+            self._trim_log(logged)
+            print("Uploaded database to S3")
+            return True
+        finally:
+            snapshot.unlink(missing_ok=True)
+            _remove_sidecars(snapshot)
+
+    def _merge_remote(self) -> bool:
+        """Replay the change log onto the newest S3 version and upload the result."""
+        incoming = self.path.with_name(self.path.name + ".incoming")
+        try:
+            for _ in range(MERGE_ATTEMPTS):
+                head = self._fetch(incoming)
+                lock = self._lock_writers()
+                try:
+                    logged = len(self._log)
+                    self._replay(incoming, self._log[:logged])
+                    result = self._put(incoming, head.get("ETag"))
+                    if result is None:
+                        # Lost the race again, start over from the newer version
+                        lock.rollback()
+                        continue
+                    self._copy_into(lock, incoming)
+                    lock.commit()
+                finally:
+                    lock.close()
+                self._write_meta(result.get("ETag"), result.get("VersionId"))
+                self._trim_log(logged)
+                print(f"Merged {logged} local transactions into the S3 database")
+                if self.on_reload is not None:
+                    self.on_reload()
+                return True
+        finally:
+            incoming.unlink(missing_ok=True)
+            _remove_sidecars(incoming)
+        print("Gave up merging with the S3 database after repeated conflicts")
+        return False
+
+    def _replay(self, destination: Path, transactions: List[list]):
+        """Apply logged transactions to another copy of the database."""
+        conn = sqlite3.connect(str(destination), isolation_level=None)
+        try:
+            for statements in transactions:
+                conn.execute("SAVEPOINT replay")
+                try:
+                    for statement, parameters, executemany in statements:
+                        if executemany:
+                            conn.executemany(statement, parameters)
+                        else:
+                            conn.execute(statement, parameters)
+                    conn.execute("RELEASE replay")
+                except sqlite3.Error as e:
+                    # e.g. a username another instance registered first
+                    conn.execute("ROLLBACK TO replay")
+                    conn.execute("RELEASE replay")
+                    print(f"Skipped a local transaction that no longer applies: {e}")
+        finally:
+            conn.close()
+        if transactions and self.on_replay is not None:
+            self.on_replay(destination)
+
+    def _copy_into(self, conn: sqlite3.Connection, source: Path):
+        """Overwrite every table's rows in `conn`'s open transaction with `source`'s."""
+        incoming = sqlite3.connect(str(source))
+        try:
+            tables = [
+                row[0] for row in incoming.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                )
+            ]
+            for table in tables:
+                local_columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+                if not local_columns:
+                    continue
+                columns = [
+                    row[1] for row in incoming.execute(f'PRAGMA table_info("{table}")')
+                    if row[1] in local_columns
+                ]
+                column_list = ", ".join(f'"{c}"' for c in columns)
+                placeholders = ", ".join("?" for _ in columns)
+                conn.execute(f'DELETE FROM "{table}"')
+                conn.executemany(
+                    f'INSERT INTO "{table}" ({column_list}) VALUES ({placeholders})',
+                    incoming.execute(f'SELECT {column_list} FROM "{table}"'),
+                )
+        finally:
+            incoming.close()
@@ -0,0 +1,139 @@
+# importer.py - Streaming bulk import of municipal fountain CSV data
+
+import ast
+import csv
+import re
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, List, TextIO, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import Fountain, FountainRoute, FountainType
+from spatial import grid_cell
+
+IMPORT_BATCH_SIZE = 5000
+
+TYPE_CONVERTER = {
+    'ברזית גליל': FountainType.cylindrical_fountain,
+    'ברזיית עלה': FountainType.leaf_fountain,
+    'קולר': FountainType.cooler,
+    'ברזיה מרובעת': FountainType.square_fountain,
+    'ברזית פטריה': FountainType.mushroom_fountain
+}
+
+# Columns refreshed from the CSV when importing over existing fountains
+UPDATED_COLUMNS = ("address", "latitude", "longitude", "grid_cell", "dog_friendly", "type", "last_updated")
+
+# Coordinates look like "{'x': 34.78, 'y': 32.09}"
+_COORDINATES = re.compile(
+    r"""['"]x['"]\s*:\s*(-?[\d.eE+-]+)\s*,\s*['"]y['"]\s*:\s*(-?[\d.eE+-]+)"""
+)
+
+
+def extract_coordinates(coord_str: str) -> Tuple[float, float]:
+    """Extract longitude and latitude from coordinate string."""
+    match = _COORDINATES.search(coord_str)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    d = ast.literal_eval(coord_str)
+    return float(d['x']), float(d['y'])
+
+
+def parse_dog_friendly(value) -> bool:
+    """Handle dog_friendly - can be 'True', 'False', 'Yes', 'No', 1, 0."""
+    if isinstance(value, str):
+        return value.lower() in ('true', 'yes', '1')
+    return bool(value)
+
+
+def parse_row(row: dict, now: datetime) -> dict:
+    """Turn one CSV row into Fountain column values."""
+    longitude, latitude = extract_coordinates(row['coordinates'])
+    return {
+        "id": int(row['oid']),
+        "type": TYPE_CONVERTER.get(row['fountain_type'], FountainType.cylindrical_fountain),
+        "address": row['open_map_address'],
+        "latitude": latitude,
+        "longitude": longitude,
+        "grid_cell": grid_cell(longitude, latitude),
+        "dog_friendly": parse_dog_friendly(row.get('dog_friendly', 'False')),
+        "bottle_refill": False,
+        "average_general_rating": 0.0,
+        "number_of_ratings": 0,
+        "last_updated": now,
+        "status": "verified",
+    }
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_fountains(
+    db: Session,
+    csv_file: TextIO,
+    update_existing: bool = False,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    shards=None,
+) -> dict:
+    """Stream fountains from a CSV file into the database in batches.
+
+    Existing IDs are loaded with a single query up front. New fountains are
+    inserted with one executemany per batch; existing ones are skipped, or
+    refreshed with INSERT ... ON CONFLICT DO UPDATE when `update_existing`
+    is set (ratings and user data are left alone). Rows that cannot be
+    parsed are skipped. With `shards` (a ShardSet) each batch is split by
+    region shard and routed. The caller commits.
+    """
+    started = time.perf_counter()
+    known = select(Fountain.id) if shards is None else select(FountainRoute.fountain_id)
+    existing_ids = set(db.execute(known).scalars())
+    table = Fountain.__table__
+    statement = insert(table)
+    if update_existing:
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={name: statement.excluded[name] for name in UPDATED_COLUMNS},
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=[table.c.id])
+
+    report = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0, "invalid": 0}
+    now = datetime.now()
+    for batch in _batches(csv.DictReader(csv_file), batch_size):
+        values = []
+        for row in batch:
+            report["rows"] += 1
+            try:
+                fountain = parse_row(row, now)
+            except (KeyError, ValueError, SyntaxError, TypeError):
+                report["invalid"] += 1
+                continue
+            if fountain["id"] in existing_ids:
+                if not update_existing:
+                    report["skipped"] += 1
+                    continue
+                report["updated"] += 1
+            else:
+                existing_ids.add(fountain["id"])
+                report["inserted"] += 1
+            values.append(fountain)
+        if shards is not None and values:
+            for shard, rows in shards.place_fountains(db, values).items():
+                db.execute(statement, rows, bind_arguments={"shard_id": shard})
+        elif values:
+            db.execute(statement, values)
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_second"] = round(report["rows"] / elapsed) if elapsed > 0 else None
+    return report
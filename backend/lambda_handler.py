@@ -1,7 +1,27 @@
 # lambda_handler.py - AWS Lambda entry point using Mangum
 
 from mangum import Mangum
-from main import app
+from main import (
+    app, wait_for_background_work,
+    PHOTO_VARIANTS_EVENT, dispatch_photo_variants, handle_photo_variants_event
+)
 
-# Create the Lambda handler
-handler = Mangum(app, lifespan="off")
+asgi_handler = Mangum(app, lifespan="off")
+
+
+def handler(event, context):
+    """Handle the request, then let background work finish before Lambda freezes.
+
+    The HTTP response is only sent once this returns, so photo variants are
+    handed to asynchronous invocations of this function rather than made here.
+    """
+    if PHOTO_VARIANTS_EVENT in event:
+        handle_photo_variants_event(event)
+        wait_for_background_work()
+        return None
+    response = asgi_handler(event, context)
+    wait_for_background_work()
+    # The photo rows are in S3 now, so the invoked instances will find them
+    dispatch_photo_variants()
+    wait_for_background_work()
+    return response
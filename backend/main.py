@@ -1,26 +1,54 @@
 # main.py
 
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File
+import time
+
+# Taken before the heavy imports below so cold start timings include them
+_COLD_START_BEGAN = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordBearer
 
-from sqlalchemy import create_engine
+from sqlalchemy import and_, create_engine, event, func, inspect, or_, text
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import NullPool
 from models import (
     Review, Fountain, User, Photo,
     UserCreate, UserLogin, UserResponse, Token, AuthResponse,
-    ReviewCreate, ReviewResponse, FountainType,
+    ReviewCreate, ReviewResponse,
     FountainReport, FountainReportCreate, FountainReportResponse,
-    ReportType, ReportStatus, FountainCreate
+    ReportType, ReportStatus, FountainCreate, FountainStats, PhotoUploadRequest,
+    FountainRoute, PhotoRoute
 )
 from auth import (
     get_password_hash, authenticate_user, create_access_token,
-    get_user_by_email, get_user_by_username, get_user_by_id,
-    decode_token, oauth2_scheme, ACCESS_TOKEN_EXPIRE_MINUTES
+    get_user_by_email, get_user_by_username,
+    decode_token, oauth2_scheme, ACCESS_TOKEN_EXPIRE_MINUTES,
+    get_usernames, username_cache, SECRET_KEY, PasswordHasherBusy,
+    get_cached_user, invalidate_users, user_cache, auth_cache_stats
+)
+from cache import TTLCache
+from spatial import (
+    WORLD_BBOX, FountainIndex, cluster_bbox, grid_cell, grid_cell_ranges, rank_nearest, search_bbox
 )
+from aggregates import apply_review, recompute_all, stats_summary
+from importer import import_fountains
+from photos import (
+    PhotoProcessor, UploadLimitMiddleware, UploadTooLarge, VARIANT_CONTENT_TYPE,
+    file_digest, save_local, save_s3, sign_upload, verify_upload
+)
+from database import DEFAULT_SQLITE_PROFILE, RoutingSession, create_sqlite_engines
+from db_sync import DatabaseSync, RowIds
+from shards import SHARDED_TABLES, ShardSession, ShardSet, shard_path
+from metrics import Metrics, MetricsMiddleware, phase, track_engine
+from querylog import QueryLog, QueryLogMiddleware, query_budget
+from pagination import MAX_PAGE_SIZE, PAGE_SIZE, keyset_page
+from versions import DataVersions, http_date, is_not_modified
 from dotenv import load_dotenv
 from sqlmodel import SQLModel, select, update
+import math
 import os
 import json
 import uuid
@@ -29,6 +57,8 @@ from fastapi_pagination import Page, add_pagination
 from fastapi_pagination.ext.sqlmodel import paginate
 from typing import Optional, List
 from pathlib import Path
+from contextlib import asynccontextmanager
+from anyio import to_thread
 
 # Load environment variables
 load_dotenv()
@@ -52,6 +82,30 @@ LOCAL_DB_PATH = Path("berez.db")
 # Lambda paths
 LAMBDA_DB_PATH = Path("/tmp/berez.db")
 
+# Cold start phase timings in ms, logged once the app is ready
+cold_start_phases = {}
+_cold_start_mark = _COLD_START_BEGAN
+
+
+def _cold_start_phase(name: str):
+    """Record how long the cold start phase that just finished took."""
+    global _cold_start_mark
+    now = time.perf_counter()
+    cold_start_phases[name] = round((now - _cold_start_mark) * 1000, 1)
+    _cold_start_mark = now
+
+
+def _log_cold_start():
+    total = round((time.perf_counter() - _COLD_START_BEGAN) * 1000, 1)
+    phases = " ".join(f"{name}={ms}ms" for name, ms in cold_start_phases.items())
+    details = ""
+    if db_sync is not None and db_sync.download_stats:
+        details = " db_download=" + json.dumps(db_sync.download_stats)
+    print(f"Cold start: total={total}ms {phases}{details}")
+
+
+_cold_start_phase("imports")
+
 # S3 client (lazy initialization)
 _s3_client = None
 
@@ -63,6 +117,16 @@ def get_s3_client():
     return _s3_client
 
 
+_lambda_client = None
+
+def get_lambda_client():
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+        _lambda_client = boto3.client('lambda', region_name=AWS_REGION)
+    return _lambda_client
+
+
 def get_db_path() -> Path:
     """Get the appropriate database path based on environment."""
     if IS_LAMBDA:
@@ -70,69 +134,585 @@ def get_db_path() -> Path:
     return LOCAL_DB_PATH
 
 
+# Request metrics for /metrics; on Lambda each request is also logged as JSON
+metrics = Metrics(log_requests=IS_LAMBDA)
+
+# Statements slower than this are logged with their EXPLAIN QUERY PLAN
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# X-Query-Count response header (queries, DB time, budget); off in deployments
+QUERY_DEBUG = os.getenv("QUERY_DEBUG", "1" if ENVIRONMENT == "local" else "0") == "1"
+# Fail any query past its route's @query_budget instead of only logging it
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "0") == "1"
+query_log = QueryLog(SLOW_QUERY_MS / 1000, strict=QUERY_BUDGET_STRICT)
+
+
+def rederive_aggregates(path: Path):
+    """Rebuild rating aggregates in a database the change log was replayed into.
+
+    Replayed statements write the fountain's average and count as absolute
+    values computed against the old copy, so they are recomputed from the
+    merged reviews.
+    """
+    replay_engine = create_engine(f"sqlite:///{path}", poolclass=NullPool)
+    try:
+        with Session(replay_engine) as session:
+            recompute_all(session)
+            session.commit()
+    finally:
+        replay_engine.dispose()
+
+
+# S3 sync for the Lambda database (None when running locally)
+db_sync = (
+    DatabaseSync(get_s3_client, DB_BUCKET, 'berez.db', get_db_path(), on_replay=rederive_aggregates)
+    if IS_LAMBDA and DB_BUCKET else None
+)
+
+
 def init_lambda_db():
     """Download SQLite database from S3 on Lambda cold start."""
-    if not IS_LAMBDA or not DB_BUCKET:
+    if db_sync is None:
         return
-    
-    db_path = get_db_path()
-    s3 = get_s3_client()
-    
-    try:
-        # Try to download existing database from S3
-        s3.download_file(DB_BUCKET, 'berez.db', str(db_path))
-        print(f"Downloaded database from S3 to {db_path}")
-    except Exception as e:
-        # Database doesn't exist in S3 yet, will be created fresh
-        print(f"No existing database in S3, will create new: {e}")
+    db_sync.download()
+
+
+# S3 sync of each region shard opened so far, by name (DB_SHARDING=region)
+shard_syncs: dict = {}
 
 
 def save_lambda_db():
-    """Upload SQLite database to S3 after changes."""
-    if not IS_LAMBDA or not DB_BUCKET:
+    """Schedule an upload of the SQLite database (and any open shards) to S3 after changes."""
+    if db_sync is None:
         return
-    
-    db_path = get_db_path()
-    if not db_path.exists():
+    with phase(metrics, "s3_sync"):
+        db_sync.mark_dirty()
+        for sync in list(shard_syncs.values()):
+            sync.mark_dirty()
+
+
+def wait_for_db_sync(timeout: Optional[float] = None):
+    """Block until committed changes have reached S3 (call before Lambda freezes)."""
+    if db_sync is None:
         return
-    
-    s3 = get_s3_client()
-    try:
-        s3.upload_file(str(db_path), DB_BUCKET, 'berez.db')
-        print(f"Uploaded database to S3")
-    except Exception as e:
-        print(f"Failed to upload database to S3: {e}")
+    db_sync.wait(timeout)
+    for sync in list(shard_syncs.values()):
+        sync.wait(timeout)
+
+
+def wait_for_background_work():
+    """Finish photo processing and S3 sync before Lambda freezes the sandbox."""
+    with phase(metrics, "background_wait"):
+        photo_processor.wait()
+        wait_for_db_sync()
 
 
 # Initialize Lambda database on cold start
 if IS_LAMBDA:
     init_lambda_db()
+    _cold_start_phase("db_download")
 
 # Database Configuration - Use SQLite
 db_path = get_db_path()
+
+# Endpoints are plain `def`, so FastAPI runs their blocking SQLite work in a
+# worker thread; this bounds how many run at once
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "16"))
 DATABASE_URL = f"sqlite:///{db_path}"
 
 # Create uploads directory for local development
 if not IS_LAMBDA:
     UPLOAD_DIR.mkdir(exist_ok=True)
 
-# SQLAlchemy setup
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},  # Needed for SQLite
-    pool_pre_ping=True,
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# "region": fountains, with their reviews, photos, reports and rating
+# aggregates, live in one SQLite file per SHARD_DEGREES tile (berez-34_32.db),
+# opened (on Lambda: downloaded) only once a request needs them. berez.db
+# keeps the users and the routing index. Off: everything in berez.db.
+DB_SHARDING = os.getenv("DB_SHARDING", "off")
+SHARD_DEGREES = float(os.getenv("SHARD_DEGREES", "1.0"))
+
+# SQLAlchemy setup: `engine` takes every write, `read_engine` (None with the
+# legacy profile) serves plain SELECTs
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", DEFAULT_SQLITE_PROFILE)
+engine, read_engine = create_sqlite_engines(DATABASE_URL, SQLITE_PROFILE, DB_THREADPOOL_SIZE)
+
+# Snowflake-style ids; see the listeners below
+row_ids = db_sync.ids if db_sync is not None else RowIds()
+
+if DB_SHARDING == "region":
+    shard_set = ShardSet(
+        engine, read_engine, lambda name: open_shard(name), SHARD_DEGREES, row_ids.new_id,
+        on_open=lambda name, *engines: index_shard(engines[1] or engines[0])
+    )
+    SessionLocal = sessionmaker(class_=ShardSession, autocommit=False, autoflush=False, shards=shard_set)
+else:
+    shard_set = None
+    SessionLocal = sessionmaker(
+        class_=RoutingSession, autocommit=False, autoflush=False, bind=engine, read_bind=read_engine
+    )
+
+# Log committed writes so they can be replayed if another instance uploads first
+if db_sync is not None:
+    # Sharded, a session cannot tell which files it wrote, so commits mark their own
+    db_sync.track(engine, mark_dirty=shard_set is not None)
+    db_sync.on_upload = lambda seconds, uploaded: metrics.record_background("s3_sync", seconds)
+
+if db_sync is not None or shard_set is not None:
+    # Ids that cannot collide with another instance's or another shard's, so
+    # replays stay correct and a row's id alone finds its shard
+    for _model in (User, Fountain, Photo, Review, FountainReport):
+        event.listen(_model, "before_insert", row_ids.assign_id)
+
+
+def track_database(*engines):
+    for _engine in engines:
+        if _engine is not None:
+            track_engine(_engine)
+            query_log.track(_engine)
+
+
+track_database(engine, read_engine)
 
 # Create tables
 SQLModel.metadata.create_all(engine)
 
+
+def add_missing_columns(target=engine, tables=None):
+    """Add new nullable columns to existing tables (create_all only creates tables)."""
+    with target.begin() as conn:
+        inspector = inspect(conn)
+        for table in tables or SQLModel.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=target.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                for index in table.indexes:
+                    if column.name in index.columns:
+                        index.create(conn, checkfirst=True)
+                print(f"Added column {table.name}.{column.name}")
+
+
+add_missing_columns()
+
+
+def add_missing_indexes(target=engine, tables=None):
+    """Create indexes added to models after their table already existed."""
+    tables = tables or SQLModel.metadata.sorted_tables
+    with target.begin() as conn:
+        existing = {table.name: {index["name"] for index in inspect(conn).get_indexes(table.name)}
+                    for table in tables}
+        for table in tables:
+            for index in table.indexes:
+                if index.name not in existing[table.name]:
+                    index.create(conn)
+                    print(f"Created index {index.name}")
+
+
+add_missing_indexes()
+
+
+def backfill_fountain_stats(sessions=SessionLocal):
+    """Build rating aggregates once for databases created before they existed."""
+    with sessions() as session:
+        has_stats = session.query(FountainStats.fountain_id).first() is not None
+        if has_stats or session.query(Review.id).first() is None:
+            return
+        count = recompute_all(session)
+        session.commit()
+        print(f"Built rating aggregates for {count} fountains")
+
+
+backfill_fountain_stats()
+
+
+def backfill_grid_cells(sessions=SessionLocal):
+    """Compute the spatial key of fountains stored before it existed."""
+    with sessions() as session:
+        rows = session.query(Fountain.id, Fountain.longitude, Fountain.latitude).filter(
+            Fountain.grid_cell.is_(None)
+        ).all()
+        if not rows:
+            return
+        session.execute(update(Fountain), [
+            {"id": fountain_id, "grid_cell": grid_cell(longitude, latitude)}
+            for fountain_id, longitude, latitude in rows
+        ])
+        session.commit()
+        print(f"Computed grid cells for {len(rows)} fountains")
+
+
+if shard_set is None:
+    backfill_fountain_stats()
+    backfill_grid_cells()
+else:
+    # Each shard is brought up to date when it is opened
+    shard_set.load()
+_cold_start_phase("schema")
+
+
+def open_shard(name: str):
+    """Open a region shard's database, downloading it first on Lambda, and update its schema."""
+    path = shard_path(db_path, name)
+    with phase(metrics, "shard_open"):
+        sync = None
+        if db_sync is not None:
+            sync = DatabaseSync(get_s3_client, DB_BUCKET, path.name, path, on_replay=rederive_aggregates)
+            sync.download()
+            sync.on_upload = lambda seconds, uploaded: metrics.record_background("s3_sync", seconds)
+            # Other instances' fountains arrive wholesale with a merge
+            sync.on_reload = build_fountain_index
+        shard_engine, shard_read_engine = create_sqlite_engines(
+            f"sqlite:///{path}", SQLITE_PROFILE, DB_THREADPOOL_SIZE
+        )
+        if sync is not None:
+            sync.track(shard_engine, mark_dirty=True)
+            shard_syncs[name] = sync
+        track_database(shard_engine, shard_read_engine)
+        SQLModel.metadata.create_all(shard_engine, tables=SHARDED_TABLES)
+        add_missing_columns(shard_engine, SHARDED_TABLES)
+        add_missing_indexes(shard_engine, SHARDED_TABLES)
+        shard_sessions = sessionmaker(bind=shard_engine)
+        backfill_fountain_stats(shard_sessions)
+        backfill_grid_cells(shard_sessions)
+    print(f"Opened shard {name}")
+    return shard_engine, shard_read_engine
+
+# "memory": nearest and viewport lookups use the in-process spatial index,
+# built at startup. "sql": they query the indexed Fountain.grid_cell column
+# instead, and the in-process index is only loaded once clusters are asked for.
+# Sharded, the index only holds the shards opened so far, so nearest lookups
+# always take the SQL route.
+SPATIAL_INDEX = os.getenv("SPATIAL_INDEX", "memory")
+# First search radius of SQL nearest lookups, and the most it grows per extra round
+SQL_NEAREST_START_M = 5000
+SQL_NEAREST_MAX_GROWTH = 8
+# Circles searched before a SQL nearest lookup falls back to ranking every fountain
+SQL_NEAREST_MAX_ROUNDS = 2
+
+# Process-wide spatial index over fountain coordinates
+fountain_index = FountainIndex()
+# True while fountain_index may be missing rows (SQL mode before the first cluster request)
+fountain_index_stale = False
+
+
+# Fountain totals by status and type, dropped whenever a commit could change them
+fountain_counts_cache = TTLCache(max_size=1, ttl_seconds=300)
+
+# Versions behind the ETags of read endpoints
+data_versions = DataVersions()
+
+
+def fountain_index_rows(session) -> list:
+    return session.query(
+        Fountain.id, Fountain.longitude, Fountain.latitude,
+        Fountain.average_general_rating, Fountain.number_of_ratings
+    ).execution_options(open_shards_only=True).all()
+
+
+def load_fountain_index():
+    """Load every fountain's coordinates (sharded: in the open shards) into the spatial index."""
+    global fountain_index_stale
+    with SessionLocal() as session:
+        fountain_index.build(fountain_index_rows(session))
+    fountain_index_stale = False
+
+
+def index_shard(shard_engine):
+    """Add the fountains of a shard that was just opened to the spatial index."""
+    if fountain_index_stale:
+        return
+    with Session(shard_engine) as session:
+        for row in fountain_index_rows(session):
+            fountain_index.upsert(*row)
+
+
+def build_fountain_index():
+    """Refresh everything derived from the fountain table after bulk changes."""
+    global fountain_index_stale
+    if SPATIAL_INDEX == "sql":
+        fountain_index_stale = True
+    else:
+        load_fountain_index()
+    fountain_counts_cache.clear()
+    data_versions.bump_all()
+
+
+def loaded_fountain_index(bbox) -> FountainIndex:
+    """The spatial index, holding at least every fountain inside `bbox`."""
+    if shard_set is not None:
+        shard_set.open_covering(bbox)
+    if fountain_index_stale:
+        load_fountain_index()
+    return fountain_index
+
+
+def in_bbox(bbox):
+    """SQL filter for fountains inside a bounding box, narrowed by grid_cell first."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return and_(
+        or_(*(Fountain.grid_cell.between(low, high) for low, high in grid_cell_ranges(bbox))),
+        Fountain.longitude.between(min_lon, max_lon),
+        Fountain.latitude.between(min_lat, max_lat),
+    )
+
+
+def nearest_from_db(db: Session, longitude: float, latitude: float, k: int, total: int,
+                    max_distance_m: Optional[float] = None) -> list:
+    """Like FountainIndex.nearest, but candidates come from the grid_cell index.
+
+    Each round ranks the fountains inside a circle exactly, so once it holds
+    k of them they are the k nearest. Otherwise the radius grows by the
+    factor that would fit k fountains at the density seen so far. When k
+    covers all `total` fountains, or after SQL_NEAREST_MAX_ROUNDS circles,
+    every fountain is ranked in one last query.
+    """
+    if k <= 0:
+        return []
+    distance = max_distance_m or SQL_NEAREST_START_M
+    rounds = 0
+    while True:
+        rounds += 1
+        if max_distance_m is None and (k >= total or rounds > SQL_NEAREST_MAX_ROUNDS):
+            rows = db.query(Fountain.id, Fountain.longitude, Fountain.latitude).all()
+            return rank_nearest(rows, longitude, latitude, k)
+        bbox = search_bbox(longitude, latitude, distance)
+        rows = db.query(Fountain.id, Fountain.longitude, Fountain.latitude).filter(in_bbox(bbox)).all()
+        ranked = rank_nearest(rows, longitude, latitude, k, distance)
+        if len(ranked) == k or max_distance_m is not None or bbox == WORLD_BBOX:
+            return ranked
+        if len(rows) >= total:
+            # The box already holds every fountain
+            return rank_nearest(rows, longitude, latitude, k)
+        growth = 1.5 * math.sqrt(k / len(ranked)) if ranked else SQL_NEAREST_MAX_GROWTH
+        distance *= min(max(growth, 2), SQL_NEAREST_MAX_GROWTH)
+
+
+def get_fountain_counts(db: Session) -> dict:
+    """Fountain totals overall, by status and by type (cached between writes)."""
+    counts = fountain_counts_cache.get("counts")
+    if counts is None:
+        counts = {"total": 0, "by_status": {}, "by_type": {}}
+        # Sharded, the routing index keeps what they are counted by
+        counted = Fountain if shard_set is None else FountainRoute
+        rows = db.query(counted.status, counted.type, func.count()).group_by(
+            counted.status, counted.type
+        ).all()
+        for fountain_status, fountain_type, count in rows:
+            counts["total"] += count
+            counts["by_status"][fountain_status] = counts["by_status"].get(fountain_status, 0) + count
+            type_name = fountain_type.name if fountain_type is not None else None
+            counts["by_type"][type_name] = counts["by_type"].get(type_name, 0) + count
+        fountain_counts_cache.set("counts", counts)
+    return counts
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_fountain_changes(session, flush_context):
+    """Remember fountains written in this transaction until it commits."""
+    upserts = session.info.setdefault("fountain_upserts", {})
+    deletes = session.info.setdefault("fountain_deletes", set())
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Fountain) and obj.id is not None:
+            upserts[obj.id] = (
+                obj.longitude, obj.latitude,
+                obj.average_general_rating, obj.number_of_ratings
+            )
+            deletes.discard(obj.id)
+            state = inspect(obj)
+            if obj in session.new or any(
+                state.attrs[name].history.has_changes() for name in ("status", "type")
+            ):
+                session.info["fountain_counts_changed"] = True
+    for obj in session.deleted:
+        if isinstance(obj, Fountain) and obj.id is not None:
+            upserts.pop(obj.id, None)
+            deletes.add(obj.id)
+            session.info["fountain_counts_changed"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_fountain_changes(session):
+    """Update the spatial index once fountain writes are committed."""
+    for fountain_id, values in session.info.pop("fountain_upserts", {}).items():
+        fountain_index.upsert(fountain_id, *values)
+    for fountain_id in session.info.pop("fountain_deletes", set()):
+        fountain_index.remove(fountain_id)
+    if session.info.pop("fountain_counts_changed", False):
+        fountain_counts_cache.clear()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_fountain_changes(session):
+    session.info.pop("fountain_upserts", None)
+    session.info.pop("fountain_deletes", None)
+    session.info.pop("fountain_counts_changed", None)
+
+
+build_fountain_index()
+_cold_start_phase("spatial_index")
+
+
+def reload_local_state():
+    """Drop in-memory state derived from rows after the database was replaced."""
+    if shard_set is not None:
+        shard_set.load()
+    build_fountain_index()
+    username_cache.clear()
+    user_cache.clear()
+
+
+# A merge with another instance's upload replaces the local rows wholesale
+if db_sync is not None:
+    db_sync.on_reload = reload_local_state
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _flag_flushed_writes(session, flush_context):
+    session.info["has_writes"] = True
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _flag_statement_writes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["has_writes"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _sync_committed_writes(session):
+    """Only transactions that actually wrote mark the database for upload."""
+    # Sharded, every file's commits mark it themselves (see DatabaseSync.track)
+    if session.info.pop("has_writes", False) and shard_set is None:
+        save_lambda_db()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_write_flag(session):
+    session.info.pop("has_writes", None)
+
+
+# Tables whose rows show up in cached read responses
+VERSIONED_TABLES = {"fountain", "review", "photo", "fountainreport"}
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_touched_fountains(session, flush_context):
+    """Remember which fountains' responses this transaction changes."""
+    touched = session.info.setdefault("touched_fountains", set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Fountain):
+            touched.add(obj.id)
+        elif isinstance(obj, (Review, Photo, FountainReport)) and obj.fountain_id is not None:
+            touched.add(obj.fountain_id)
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _flag_bulk_writes(orm_execute_state):
+    """Bulk statements can touch any fountain, so they invalidate everything."""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if getattr(table, "name", None) in VERSIONED_TABLES:
+            orm_execute_state.session.info["bulk_writes"] = True
+        # Their synchronisation leaves no attribute history for the flush
+        # hooks to spot status or type changes in, so drop the totals too
+        if getattr(table, "name", None) in (Fountain.__tablename__, FountainRoute.__tablename__):
+            orm_execute_state.session.info["fountain_counts_changed"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _bump_data_versions(session):
+    touched = session.info.pop("touched_fountains", None)
+    if session.info.pop("bulk_writes", False):
+        data_versions.bump_all()
+    elif touched:
+        data_versions.bump(touched)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changed_users(session, flush_context):
+    """Remember users updated or deleted in this transaction."""
+    changed = session.info.setdefault("changed_users", set())
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _flag_bulk_user_writes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if getattr(table, "name", None) == User.__tablename__:
+            orm_execute_state.session.info["bulk_user_writes"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _invalidate_cached_users(session):
+    """Drop cached snapshots so deactivations apply on the next request."""
+    changed = session.info.pop("changed_users", None)
+    if session.info.pop("bulk_user_writes", False):
+        user_cache.clear()
+    elif changed:
+        invalidate_users(changed)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("changed_users", None)
+    session.info.pop("bulk_user_writes", None)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_touched_fountains(session):
+    session.info.pop("touched_fountains", None)
+    session.info.pop("bulk_writes", None)
+
+
+# Browsers and API Gateway/CloudFront may reuse a read briefly, then revalidate
+READ_CACHE_CONTROL = "public, max-age=10, stale-while-revalidate=30"
+
+
+def not_modified(request: Request, response: Response, validators) -> Optional[Response]:
+    """Set caching headers; return a 304 response if the client's copy is current."""
+    etag, modified = validators
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(modified),
+        "Cache-Control": READ_CACHE_CONTROL,
+    }
+    if is_not_modified(
+        etag, modified,
+        request.headers.get("if-none-match"), request.headers.get("if-modified-since")
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def page_of(query, created_column, id_column, cursor: Optional[str], limit: int):
+    """keyset_page, with malformed cursors answered as 400."""
+    try:
+        return keyset_page(query, created_column, id_column, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Size the threadpool that runs the synchronous endpoints."""
+    to_thread.current_default_thread_limiter().total_tokens = DB_THREADPOOL_SIZE
+    yield
+
+
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# Whole multipart request: the photo plus room for the form framing
+MAX_UPLOAD_REQUEST = MAX_FILE_SIZE + 64 * 1024
+
 # FastAPI app
 app = FastAPI(
     title="Berez API",
     description="API for the Berez drinking fountain finder app",
     version="1.0.0",
-    root_path="" if not IS_LAMBDA else f"/{ENVIRONMENT}"
+    root_path="" if not IS_LAMBDA else f"/{ENVIRONMENT}",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -140,13 +720,25 @@ origins = [APP_URL]
 if "localhost" not in APP_URL:
     origins.append("http://localhost:3000")
 
+# Refuses oversized uploads before the multipart parser spools them. Added
+# first so it runs inside CORS, and browsers can read its 413.
+app.add_middleware(
+    UploadLimitMiddleware,
+    paths=("/photos/upload", "/photos/direct/"),
+    max_bytes=MAX_UPLOAD_REQUEST,
+    detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024)}MB",
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(QueryLogMiddleware, debug_header=QUERY_DEBUG)
+# Outermost, so CORS preflights and errors are measured too
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 # Mount uploads directory for local development
 if not IS_LAMBDA:
@@ -161,13 +753,12 @@ def get_db():
     try:
         yield db
     finally:
+        # Commits that wrote anything have already scheduled an S3 upload
         db.close()
-        # Save database to S3 after each request (for Lambda)
-        save_lambda_db()
 
 
 # Auth dependency that works with our get_db
-async def get_current_user_optional(
+def get_current_user_optional(
     token: Optional[str] = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ) -> Optional[User]:
@@ -175,18 +766,18 @@ async def get_current_user_optional(
     if token is None:
         return None
     
-    token_data = decode_token(token)
-    if token_data is None:
-        return None
-        
-    user = get_user_by_id(db, token_data.user_id)
+    with phase(metrics, "auth"):
+        token_data = decode_token(token)
+        if token_data is None:
+            return None
+        user = get_cached_user(db, token_data.user_id)
     if user is None or not user.is_active:
         return None
     
     return user
 
 
-async def get_current_user_required(
+def get_current_user_required(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ) -> User:
@@ -200,11 +791,11 @@ async def get_current_user_required(
     if token is None:
         raise credentials_exception
     
-    token_data = decode_token(token)
-    if token_data is None:
-        raise credentials_exception
-        
-    user = get_user_by_id(db, token_data.user_id)
+    with phase(metrics, "auth"):
+        token_data = decode_token(token)
+        if token_data is None:
+            raise credentials_exception
+        user = get_cached_user(db, token_data.user_id)
     if user is None:
         raise credentials_exception
     
@@ -219,9 +810,16 @@ async def get_current_user_required(
 
 # ==================== AUTH ENDPOINTS ====================
 
-@app.post("/auth/register", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
-    """Register a new user and return auth token."""
+def password_hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+
+def check_new_user(db: Session, user_data: UserCreate):
+    """Refuse registrations whose email or username is taken."""
     if get_user_by_email(db, user_data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -233,12 +831,15 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already taken"
         )
-    
+
+
+def create_user(db: Session, user_data: UserCreate, password_hash: str) -> AuthResponse:
+    """Store a new user and return it with an access token."""
     user = User(
         username=user_data.username,
         name=user_data.name,
         email=user_data.email,
-        password_hash=get_password_hash(user_data.password)
+        password_hash=password_hash
     )
     
     try:
@@ -270,10 +871,31 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         )
 
 
+# Async, so requests waiting for bcrypt do not hold a threadpool thread;
+# their database work is handed to the threadpool explicitly
+@app.post("/auth/register", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
+async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+    """Register a new user and return auth token."""
+    await run_in_threadpool(check_new_user, db, user_data)
+    
+    try:
+        with phase(metrics, "auth"):
+            password_hash = await get_password_hash(user_data.password)
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
+    
+    return await run_in_threadpool(create_user, db, user_data, password_hash)
+
+
 @app.post("/auth/login", response_model=AuthResponse)
+@query_budget(2)
 async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     """Login and get access token with user data."""
-    user = authenticate_user(db, user_data.email, user_data.password)
+    try:
+        with phase(metrics, "auth"):
+            user = await authenticate_user(db, user_data.email, user_data.password)
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -299,6 +921,7 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
 
 
 @app.get("/auth/me", response_model=UserResponse)
+@query_budget(1)
 async def get_me(current_user: User = Depends(get_current_user_required)):
     """Get current user info."""
     return current_user
@@ -307,7 +930,6 @@ async def get_me(current_user: User = Depends(get_current_user_required)):
 # ==================== PHOTO ENDPOINTS ====================
 
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
 
 def get_photo_url(filename: str) -> str:
@@ -317,8 +939,114 @@ def get_photo_url(filename: str) -> str:
     return f"/uploads/{filename}"
 
 
+# Photo.status values; rows from before statuses existed are NULL and count as ready
+PHOTO_PENDING = "pending"
+PHOTO_READY = "ready"
+
+
+def photo_is_ready():
+    """Filter for photos whose file has actually been uploaded."""
+    return Photo.status.is_distinct_from(PHOTO_PENDING)
+
+
+def photo_variant_urls(photo: Photo) -> dict:
+    """Resized copies of a photo by width, for building a srcset."""
+    return {width: get_photo_url(name) for width, name in (photo.variants or {}).items()}
+
+
+def photo_response(photo: Photo) -> dict:
+    """Public fields of a photo."""
+    return {
+        "id": photo.id,
+        "url": get_photo_url(photo.filename),
+        "original_filename": photo.original_filename,
+        "variants": photo_variant_urls(photo)
+    }
+
+
+def read_photo_original(filename: str) -> bytes:
+    with phase(metrics, "photo_storage"):
+        if IS_LAMBDA and S3_BUCKET:
+            return get_s3_client().get_object(Bucket=S3_BUCKET, Key=filename)["Body"].read()
+        return (UPLOAD_DIR / filename).read_bytes()
+
+
+def write_photo_variant(filename: str, content: bytes):
+    with phase(metrics, "photo_storage"):
+        if IS_LAMBDA and S3_BUCKET:
+            get_s3_client().put_object(
+                Bucket=S3_BUCKET,
+                Key=filename,
+                Body=content,
+                ContentType=VARIANT_CONTENT_TYPE,
+                # Variant names are unique per upload, so they never change
+                CacheControl="public, max-age=31536000, immutable"
+            )
+        else:
+            (UPLOAD_DIR / filename).write_bytes(content)
+
+
+def record_photo_variants(photo_id: int, variants: dict):
+    # A plain UPDATE rather than load-and-set: on Lambda the photo row may be
+    # newer than this instance's copy, and the logged statement then reaches
+    # it when the S3 merge replays it onto the newest database
+    with SessionLocal() as session:
+        session.execute(update(Photo).where(Photo.id == photo_id).values(variants=variants))
+        session.commit()
+
+
+# Resized copies are made after the upload response. Locally they are
+# rendered in a process pool. On Lambda the response only leaves once the
+# handler returns, so the handler hands each photo to an asynchronous
+# invocation of the function instead (see lambda_handler.py).
+PHOTO_WORKERS = 0 if IS_LAMBDA else int(os.getenv("PHOTO_WORKERS", "2"))
+photo_processor = PhotoProcessor(
+    read_photo_original, write_photo_variant, record_photo_variants, PHOTO_WORKERS
+)
+# Event key of the asynchronous invocations that render a photo's variants
+PHOTO_VARIANTS_EVENT = "berez_photo_variants"
+# (photo id, filename) pairs waiting for the Lambda handler to dispatch
+deferred_photo_variants: List[tuple] = []
+
+
+def queue_photo_variants(photo_id: int, filename: str):
+    """Have a photo's variants made once the request is answered."""
+    if IS_LAMBDA:
+        deferred_photo_variants.append((photo_id, filename))
+    else:
+        photo_processor.submit(photo_id, filename)
+
+
+def dispatch_photo_variants():
+    """Start an asynchronous invocation per queued photo (Lambda handler only).
+
+    Called after the request's commits reached S3, so the invoked instance
+    finds the photo row. If invoking fails, the variants are rendered here.
+    """
+    while deferred_photo_variants:
+        photo_id, filename = deferred_photo_variants.pop(0)
+        try:
+            with phase(metrics, "photo_dispatch"):
+                get_lambda_client().invoke(
+                    FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+                    InvocationType="Event",
+                    Payload=json.dumps({PHOTO_VARIANTS_EVENT: {"photo_id": photo_id, "filename": filename}})
+                )
+        except Exception as e:
+            print(f"Failed to dispatch variants of photo {photo_id}, rendering them inline: {e}")
+            photo_processor.submit(photo_id, filename)
+
+
+def handle_photo_variants_event(event: dict):
+    """Render and record one photo's variants (an invocation from dispatch_photo_variants)."""
+    job = event[PHOTO_VARIANTS_EVENT]
+    with phase(metrics, "photo_variants"):
+        photo_processor.process(job["photo_id"], job["filename"])
+
+
 @app.post("/photos/upload", status_code=status.HTTP_201_CREATED)
-async def upload_photo(
+@query_budget(3)
+def upload_photo(
     file: UploadFile = File(...),
     fountain_id: Optional[int] = None,
     db: Session = Depends(get_db),
@@ -333,54 +1061,51 @@ async def upload_photo(
             detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
-    # Read file content
-    content = await file.read()
-    file_size = len(content)
-    
-    # Validate file size
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024)}MB"
-        )
+    too_large = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024)}MB"
+    )
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise too_large
     
     # Generate unique filename
     unique_filename = f"{uuid.uuid4()}{file_ext}"
+    content_type = file.content_type or "image/jpeg"
     
     try:
-        # Save to S3 or local filesystem
-        if IS_LAMBDA and S3_BUCKET:
-            s3 = get_s3_client()
-            s3.put_object(
-                Bucket=S3_BUCKET,
-                Key=unique_filename,
-                Body=content,
-                ContentType=file.content_type or "image/jpeg"
-            )
-        else:
-            file_path = UPLOAD_DIR / unique_filename
-            with open(file_path, "wb") as f:
-                f.write(content)
+        # Stream to S3 or local filesystem, sizing and hashing on the fly
+        with phase(metrics, "photo_storage"):
+            if IS_LAMBDA and S3_BUCKET:
+                file_size, content_hash = save_s3(
+                    get_s3_client(), file.file, S3_BUCKET, unique_filename, content_type, MAX_FILE_SIZE
+                )
+            else:
+                file_size, content_hash = save_local(file.file, UPLOAD_DIR / unique_filename, MAX_FILE_SIZE)
         
         # Create photo record
         photo = Photo(
             filename=unique_filename,
             original_filename=file.filename,
-            content_type=file.content_type or "image/jpeg",
+            content_type=content_type,
             file_size=file_size,
+            content_hash=content_hash,
             uploaded_by=current_user.id if current_user else None,
-            fountain_id=fountain_id
+            fountain_id=fountain_id,
+            status=PHOTO_READY
         )
         
         db.add(photo)
         db.commit()
         db.refresh(photo)
+        queue_photo_variants(photo.id, unique_filename)
         
         return {
             "message": "Photo uploaded successfully",
             "photo_id": photo.id,
             "url": get_photo_url(unique_filename)
         }
+    except UploadTooLarge:
+        raise too_large
     except Exception as e:
         # Clean up file if database operation fails
         if not IS_LAMBDA:
@@ -394,8 +1119,194 @@ async def upload_photo(
         )
 
 
+# How long a presigned upload URL stays valid
+PRESIGNED_UPLOAD_EXPIRES = 15 * 60
+# Pending photos this old were abandoned: their URL expired and the client
+# has had as long again to confirm
+PENDING_PHOTO_TTL = 2 * PRESIGNED_UPLOAD_EXPIRES
+# Presign requests sweep abandoned uploads at most this often per instance
+PENDING_SWEEP_INTERVAL = 10 * 60
+PENDING_SWEEP_BATCH = 100
+_next_pending_sweep = 0.0
+
+
+def delete_photo_files(filenames: List[str]):
+    """Remove stored originals; missing files are not an error."""
+    with phase(metrics, "photo_storage"):
+        if IS_LAMBDA and S3_BUCKET:
+            get_s3_client().delete_objects(
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": name} for name in filenames], "Quiet": True}
+            )
+        else:
+            for name in filenames:
+                (UPLOAD_DIR / name).unlink(missing_ok=True)
+
+
+def expire_pending_photos(db: Session, limit: int = PENDING_SWEEP_BATCH) -> int:
+    """Delete up to `limit` abandoned pending photos and any file uploaded for them.
+
+    Files go first, so a failure leaves the rows to be swept again.
+    Returns how many were deleted.
+    """
+    cutoff = datetime.now() - timedelta(seconds=PENDING_PHOTO_TTL)
+    # Sharded, each instance sweeps the shards it has open
+    expired = db.query(Photo.id, Photo.filename).filter(
+        Photo.status == PHOTO_PENDING, Photo.created_at < cutoff
+    ).limit(limit).execution_options(open_shards_only=True).all()
+    if not expired:
+        return 0
+    delete_photo_files([filename for _, filename in expired])
+    expired_ids = [photo_id for photo_id, _ in expired]
+    db.query(Photo).filter(Photo.id.in_(expired_ids)).delete(synchronize_session=False)
+    if shard_set is not None:
+        db.query(PhotoRoute).filter(PhotoRoute.photo_id.in_(expired_ids)).delete(synchronize_session=False)
+    db.commit()
+    return len(expired)
+
+
+def sweep_pending_photos(db: Session):
+    """Expire abandoned uploads now and then; failures only delay the next sweep."""
+    global _next_pending_sweep
+    now = time.monotonic()
+    if now < _next_pending_sweep:
+        return
+    _next_pending_sweep = now + PENDING_SWEEP_INTERVAL
+    try:
+        expired = expire_pending_photos(db)
+        if expired:
+            print(f"Expired {expired} abandoned photo uploads")
+    except Exception as e:
+        db.rollback()
+        print(f"Failed to expire abandoned photo uploads: {e}")
+
+
+@app.post("/photos/presign", status_code=status.HTTP_201_CREATED)
+@query_budget(5)
+def presign_photo_upload(
+    upload: PhotoUploadRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """Create a pending photo and a URL to upload its file to directly."""
+    file_ext = Path(upload.filename).suffix.lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    if upload.file_size > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024)}MB"
+        )
+    
+    sweep_pending_photos(db)
+    
+    unique_filename = f"{uuid.uuid4()}{file_ext}"
+    content_type = upload.content_type or "image/jpeg"
+    expires = int(time.time()) + PRESIGNED_UPLOAD_EXPIRES
+    
+    try:
+        if IS_LAMBDA and S3_BUCKET:
+            # A POST policy (unlike a presigned PUT) lets S3 enforce the size limit
+            post = get_s3_client().generate_presigned_post(
+                S3_BUCKET, unique_filename,
+                Fields={"Content-Type": content_type},
+                Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, MAX_FILE_SIZE]],
+                ExpiresIn=PRESIGNED_UPLOAD_EXPIRES
+            )
+            upload_url, fields = post["url"], post["fields"]
+        else:
+            signature = sign_upload(SECRET_KEY, unique_filename, expires)
+            upload_url = (
+                f"{request.url_for('direct_photo_upload', filename=unique_filename)}"
+                f"?expires={expires}&signature={signature}"
+            )
+            fields = {}
+        
+        photo = Photo(
+            filename=unique_filename,
+            original_filename=upload.filename,
+            content_type=content_type,
+            file_size=upload.file_size,
+            uploaded_by=current_user.id if current_user else None,
+            fountain_id=upload.fountain_id,
+            status=PHOTO_PENDING
+        )
+        db.add(photo)
+        db.commit()
+        db.refresh(photo)
+        
+        return {
+            "photo_id": photo.id,
+            # Send as multipart/form-data: every field, then the file as "file"
+            "upload": {"method": "POST", "url": upload_url, "fields": fields, "expires_at": expires}
+        }
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error preparing upload: {str(e)}"
+        )
+
+
+@app.post("/photos/direct/{filename}", name="direct_photo_upload", status_code=status.HTTP_204_NO_CONTENT)
+def direct_photo_upload(filename: str, expires: int, signature: str, file: UploadFile = File(...)):
+    """Local stand-in for an S3 presigned POST (UPLOAD_DIR storage only)."""
+    if IS_LAMBDA:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    if not verify_upload(SECRET_KEY, filename, expires, signature, time.time()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired upload URL")
+    try:
+        with phase(metrics, "photo_storage"):
+            save_local(file.file, UPLOAD_DIR / filename, MAX_FILE_SIZE)
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024)}MB"
+        )
+
+
+@app.post("/photos/{photo_id}/confirm")
+@query_budget(3)
+def confirm_photo_upload(photo_id: int, db: Session = Depends(get_db)):
+    """Mark a presigned upload as finished once its file is in storage."""
+    photo = db.query(Photo).filter(Photo.id == photo_id).first()
+    if not photo:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Photo not found")
+    
+    if photo.status == PHOTO_PENDING:
+        try:
+            with phase(metrics, "photo_storage"):
+                if IS_LAMBDA and S3_BUCKET:
+                    head = get_s3_client().head_object(Bucket=S3_BUCKET, Key=photo.filename)
+                    file_size, content_hash = head["ContentLength"], None
+                else:
+                    file_size, content_hash = file_digest(UPLOAD_DIR / photo.filename, MAX_FILE_SIZE)
+        except Exception:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Photo file has not been uploaded yet"
+            )
+        photo.file_size = file_size
+        photo.content_hash = content_hash
+        photo.status = PHOTO_READY
+        db.commit()
+        db.refresh(photo)
+        queue_photo_variants(photo.id, photo.filename)
+    
+    return {
+        "message": "Photo uploaded successfully",
+        "photo_id": photo.id,
+        "url": get_photo_url(photo.filename)
+    }
+
+
 @app.get("/photos/{photo_id}")
-async def get_photo(photo_id: int, db: Session = Depends(get_db)):
+@query_budget(1)
+def get_photo(photo_id: int, db: Session = Depends(get_db)):
     """Get photo info by ID."""
     photo = db.query(Photo).filter(Photo.id == photo_id).first()
     if not photo:
@@ -412,44 +1323,74 @@ async def get_photo(photo_id: int, db: Session = Depends(get_db)):
         "content_type": photo.content_type,
         "file_size": photo.file_size,
         "fountain_id": photo.fountain_id,
-        "created_at": photo.created_at
+        "created_at": photo.created_at,
+        "variants": photo_variant_urls(photo),
+        "status": photo.status or PHOTO_READY
     }
 
 
 @app.get("/photos/fountain/{fountain_id}")
-async def get_fountain_photos(fountain_id: int, db: Session = Depends(get_db)):
-    """Get all photos for a fountain."""
-    photos = db.query(Photo).filter(Photo.fountain_id == fountain_id).all()
-    return [
-        {
-            "id": photo.id,
-            "url": get_photo_url(photo.filename),
-            "original_filename": photo.original_filename
-        }
-        for photo in photos
-    ]
+@query_budget(1)
+def get_fountain_photos(
+    fountain_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    """Get a page of a fountain's photos, newest first (next page: X-Next-Cursor)."""
+    cached = not_modified(request, response, data_versions.fountain_validators(fountain_id))
+    if cached:
+        return cached
+    photos, next_cursor = page_of(
+        db.query(Photo).filter(Photo.fountain_id == fountain_id, photo_is_ready()),
+        Photo.created_at, Photo.id, cursor, limit
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [photo_response(photo) for photo in photos]
 
 
 # ==================== FOUNTAIN ENDPOINTS ====================
 
+# Most fountains one nearest lookup may return
+MAX_NEAREST_FOUNTAINS = 500
+
+
 @app.get("/fountains/{longitude},{latitude}")
-async def read_fountains(
+@query_budget(5)
+def read_fountains(
     longitude: float, 
     latitude: float, 
-    limit: int = 50,
+    request: Request,
+    response: Response,
+    limit: int = Query(default=50, ge=1, le=MAX_NEAREST_FOUNTAINS),
+    max_distance_m: Optional[float] = Query(default=None, gt=0),
     db=Depends(get_db)
 ):
-    """Get fountains ordered by distance from coordinates."""
+    """Get fountains ordered by distance from coordinates, with distances in meters."""
+    cached = not_modified(request, response, data_versions.global_validators())
+    if cached:
+        return cached
     try:
-        # Calculate distance and order by it
-        fountains = db.query(Fountain).order_by(
-            (Fountain.longitude - longitude) * (Fountain.longitude - longitude) +
-            (Fountain.latitude - latitude) * (Fountain.latitude - latitude)
-        ).limit(limit).all()
+        total = get_fountain_counts(db)["total"]
+        # Rank by great-circle distance, then load only those rows
+        if SPATIAL_INDEX == "sql" or shard_set is not None:
+            nearest = nearest_from_db(db, longitude, latitude, limit, total, max_distance_m)
+        else:
+            nearest = fountain_index.nearest(longitude, latitude, limit, max_distance_m)
+        rows = db.query(Fountain).filter(Fountain.id.in_([i for i, _ in nearest])).all()
+        rows_by_id = {fountain.id: fountain for fountain in rows}
+        fountains = [
+            {**rows_by_id[i].model_dump(), "distance_m": round(distance, 1)}
+            for i, distance in nearest
+            if i in rows_by_id
+        ]
         
         return {
             "items": fountains,
-            "total": db.query(Fountain).count()
+            "total": total
         }
     except Exception as e:
         raise HTTPException(
@@ -458,17 +1399,178 @@ async def read_fountains(
         )
 
 
+# Below this zoom level the viewport endpoint returns clusters instead of fountains
+CLUSTER_MAX_ZOOM = 15
+# Viewports holding more fountains than this are clustered at any zoom
+MAX_VIEWPORT_FOUNTAINS = 500
+
+
+@app.get("/fountains/stats")
+@query_budget(1)
+def get_fountain_stats(db: Session = Depends(get_db)):
+    """Get fountain counts overall, by status and by type."""
+    return get_fountain_counts(db)
+
+
+def viewport_clusters(zoom: int, bbox) -> dict:
+    # Clusters on the edge of the box also count fountains just outside it
+    index = loaded_fountain_index(cluster_bbox(zoom, bbox))
+    return {
+        "zoom": zoom,
+        "clustered": True,
+        "clusters": index.clusters(zoom, bbox)
+    }
+
+
+@app.get("/fountains/viewport")
+@query_budget(1)
+def read_viewport(
+    min_lon: float = Query(ge=-180, le=180),
+    min_lat: float = Query(ge=-90, le=90),
+    max_lon: float = Query(ge=-180, le=180),
+    max_lat: float = Query(ge=-90, le=90),
+    zoom: int = Query(ge=0, le=22),
+    db: Session = Depends(get_db)
+):
+    """Get the fountains in a map viewport, clustered when zoomed out."""
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Bounding box minimums must not exceed maximums"
+        )
+    bbox = (min_lon, min_lat, max_lon, max_lat)
+    
+    if zoom < CLUSTER_MAX_ZOOM:
+        return viewport_clusters(zoom, bbox)
+    
+    # One extra row tells a full viewport from one that would be cut short
+    if SPATIAL_INDEX == "sql":
+        fountains = db.query(Fountain).filter(in_bbox(bbox)).limit(MAX_VIEWPORT_FOUNTAINS + 1).all()
+        too_many = len(fountains) > MAX_VIEWPORT_FOUNTAINS
+    else:
+        fountain_ids = loaded_fountain_index(bbox).within(bbox, limit=MAX_VIEWPORT_FOUNTAINS + 1)
+        too_many = len(fountain_ids) > MAX_VIEWPORT_FOUNTAINS
+        fountains = [] if too_many else db.query(Fountain).filter(Fountain.id.in_(fountain_ids)).all()
+    if too_many:
+        # Rather than silently dropping pins, cover the whole box with clusters
+        return viewport_clusters(zoom, bbox)
+    return {
+        "zoom": zoom,
+        "clustered": False,
+        "items": fountains
+    }
+
+
 @app.get("/fountains/{fountain_id}", response_model=Fountain)
-async def get_fountain(fountain_id: int, db=Depends(get_db)):
+@query_budget(1)
+def get_fountain(fountain_id: int, request: Request, response: Response, db=Depends(get_db)):
     """Get a single fountain by ID."""
+    cached = not_modified(request, response, data_versions.fountain_validators(fountain_id))
+    if cached:
+        return cached
     fountain = db.query(Fountain).filter(Fountain.id == fountain_id).first()
     if fountain:
         return fountain
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fountain not found")
 
 
+DETAIL_FIELDS = ("fountain", "stats", "reviews", "photos", "reports")
+DETAIL_PAGE_SIZE = 20
+
+
+@app.get("/fountains/{fountain_id}/detail")
+@query_budget(7)
+def get_fountain_detail(
+    fountain_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = Query(default=None, description="Comma-separated subset of: " + ",".join(DETAIL_FIELDS)),
+    reviews_limit: int = Query(default=DETAIL_PAGE_SIZE, ge=0, le=100),
+    photos_limit: int = Query(default=DETAIL_PAGE_SIZE, ge=0, le=100),
+    reports_limit: int = Query(default=DETAIL_PAGE_SIZE, ge=0, le=100),
+    db: Session = Depends(get_db)
+):
+    """Get a fountain with the first pages of its reviews, photos and reports in one call.
+
+    Each list has a `next_cursor` for the `cursor` parameter of its own endpoint.
+    """
+    selected = set(DETAIL_FIELDS) if fields is None else {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = selected - set(DETAIL_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    cached = not_modified(request, response, data_versions.fountain_validators(fountain_id))
+    if cached:
+        return cached
+
+    fountain = db.query(Fountain).filter(Fountain.id == fountain_id).first()
+    if not fountain:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fountain not found")
+
+    # One query for the totals of every selected list
+    counted = {
+        "reviews": (Review, [Review.fountain_id == fountain_id]),
+        "photos": (Photo, [Photo.fountain_id == fountain_id, photo_is_ready()]),
+        "reports": (FountainReport, [FountainReport.fountain_id == fountain_id]),
+    }
+    totals_query = [
+        select(func.count()).select_from(model).where(*conditions).scalar_subquery().label(name)
+        for name, (model, conditions) in counted.items()
+        if name in selected
+    ]
+    totals = db.execute(select(*totals_query)).one()._asdict() if totals_query else {}
+
+    reviews = reports = []
+    reviews_cursor = reports_cursor = None
+    if "reviews" in selected:
+        reviews, reviews_cursor = keyset_page(
+            db.query(Review).filter(Review.fountain_id == fountain_id),
+            Review.creation_date, Review.id, None, reviews_limit
+        )
+    if "reports" in selected:
+        reports, reports_cursor = keyset_page(
+            db.query(FountainReport).filter(FountainReport.fountain_id == fountain_id),
+            FountainReport.created_at, FountainReport.id, None, reports_limit
+        )
+    usernames = get_usernames(db, [r.user_id for r in reviews] + [r.user_id for r in reports])
+
+    result = {}
+    if "fountain" in selected:
+        result["fountain"] = fountain
+    if "stats" in selected:
+        result["stats"] = stats_summary(db.get(FountainStats, fountain_id))
+    if "reviews" in selected:
+        result["reviews"] = {
+            "items": [review_response(review, usernames) for review in reviews],
+            "total": totals["reviews"],
+            "limit": reviews_limit,
+            "next_cursor": reviews_cursor
+        }
+    if "photos" in selected:
+        photos, photos_cursor = keyset_page(
+            db.query(Photo).filter(Photo.fountain_id == fountain_id, photo_is_ready()),
+            Photo.created_at, Photo.id, None, photos_limit
+        )
+        result["photos"] = {
+            "items": [photo_response(photo) for photo in photos],
+            "total": totals["photos"],
+            "limit": photos_limit,
+            "next_cursor": photos_cursor
+        }
+    if "reports" in selected:
+        result["reports"] = {
+            "items": [report_response(report, usernames) for report in reports],
+            "total": totals["reports"],
+            "limit": reports_limit,
+            "next_cursor": reports_cursor
+        }
+    return result
+
+
 @app.post("/fountain", status_code=status.HTTP_201_CREATED)
-async def create_fountain(fountain: Fountain, db=Depends(get_db)):
+def create_fountain(fountain: Fountain, db=Depends(get_db)):
     """Create a new fountain."""
     try:
         existing = db.query(Fountain).filter(Fountain.id == fountain.id).first()
@@ -493,7 +1595,7 @@ async def create_fountain(fountain: Fountain, db=Depends(get_db)):
 
 
 @app.put("/fountain")
-async def update_fountain(new_fountain: Fountain, db=Depends(get_db)):
+def update_fountain(new_fountain: Fountain, db=Depends(get_db)):
     """Update an existing fountain."""
     existing_fountain = db.query(Fountain).filter(Fountain.id == new_fountain.id).first()
     if not existing_fountain:
@@ -516,14 +1618,9 @@ async def update_fountain(new_fountain: Fountain, db=Depends(get_db)):
         if not changed_values:
             return {"message": "No changes detected", "fountain": existing_fountain}
         
-        changed_values['last_updated'] = datetime.now()
-        
-        stmt = (
-            update(Fountain)
-            .where(Fountain.id == existing_fountain.id)
-            .values(changed_values)
-        )
-        db.execute(stmt)
+        # Flushed through the unit of work rather than a bulk UPDATE, so the
+        # grid cell, spatial index and shard routing see the new values
+        existing_fountain.last_updated = datetime.now()
         db.commit()
         
         updated_fountain = db.query(Fountain).filter(Fountain.id == existing_fountain.id).first()
@@ -538,7 +1635,8 @@ async def update_fountain(new_fountain: Fountain, db=Depends(get_db)):
 
 
 @app.post("/fountains/submit", status_code=status.HTTP_201_CREATED)
-async def submit_fountain(
+@query_budget(3)
+def submit_fountain(
     fountain_data: FountainCreate,
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
@@ -577,7 +1675,8 @@ async def submit_fountain(
 
 
 @app.post("/fountains/report", status_code=status.HTTP_201_CREATED)
-async def report_fountain(
+@query_budget(5)
+def report_fountain(
     report_data: FountainReportCreate,
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
@@ -624,9 +1723,35 @@ async def report_fountain(
         )
 
 
+def report_response(report: FountainReport, usernames: dict) -> FountainReportResponse:
+    """Build a report response using pre-fetched usernames."""
+    return FountainReportResponse(
+        id=report.id,
+        fountain_id=report.fountain_id,
+        user_id=report.user_id,
+        username=usernames.get(report.user_id),
+        report_type=report.report_type,
+        description=report.description,
+        status=report.status,
+        created_at=report.created_at,
+        resolved_at=report.resolved_at
+    )
+
+
 @app.get("/fountains/{fountain_id}/reports", response_model=List[FountainReportResponse])
-async def get_fountain_reports(fountain_id: int, db: Session = Depends(get_db)):
-    """Get all reports for a fountain."""
+@query_budget(3)
+def get_fountain_reports(
+    fountain_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    """Get a page of a fountain's reports, newest first (next page: X-Next-Cursor)."""
+    cached = not_modified(request, response, data_versions.fountain_validators(fountain_id))
+    if cached:
+        return cached
     fountain = db.query(Fountain).filter(Fountain.id == fountain_id).first()
     if not fountain:
         raise HTTPException(
@@ -634,69 +1759,68 @@ async def get_fountain_reports(fountain_id: int, db: Session = Depends(get_db)):
             detail="Fountain not found"
         )
     
-    reports = db.query(FountainReport).filter(
-        FountainReport.fountain_id == fountain_id
-    ).order_by(FountainReport.created_at.desc()).all()
-    
-    result = []
-    for report in reports:
-        report_dict = {
-            "id": report.id,
-            "fountain_id": report.fountain_id,
-            "user_id": report.user_id,
-            "username": None,
-            "report_type": report.report_type,
-            "description": report.description,
-            "status": report.status,
-            "created_at": report.created_at,
-            "resolved_at": report.resolved_at
-        }
-        if report.user_id:
-            user = db.query(User).filter(User.id == report.user_id).first()
-            if user:
-                report_dict["username"] = user.username
-        result.append(FountainReportResponse(**report_dict))
+    reports, next_cursor = page_of(
+        db.query(FountainReport).filter(FountainReport.fountain_id == fountain_id),
+        FountainReport.created_at, FountainReport.id, cursor, limit
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
-    return result
+    usernames = get_usernames(db, (report.user_id for report in reports))
+    return [report_response(report, usernames) for report in reports]
 
 
 # ==================== REVIEW ENDPOINTS ====================
 
+def review_response(review: Review, usernames: dict) -> ReviewResponse:
+    """Build a review response using pre-fetched usernames."""
+    return ReviewResponse(
+        id=review.id,
+        fountain_id=review.fountain_id,
+        user_id=review.user_id,
+        username=usernames.get(review.user_id),
+        creation_date=review.creation_date,
+        general_rating=review.general_rating,
+        temp_rating=review.temp_rating,
+        stream_rating=review.stream_rating,
+        quenching_rating=review.quenching_rating,
+        description=review.description,
+        photos=review.photos
+    )
+
+
 @app.get("/reviews/{fountain_id}", response_model=List[ReviewResponse])
-async def read_reviews(fountain_id: int, db=Depends(get_db)):
-    """Get all reviews for a fountain with usernames."""
+@query_budget(3)
+def read_reviews(
+    fountain_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db=Depends(get_db)
+):
+    """Get a page of a fountain's reviews with usernames, newest first (next page: X-Next-Cursor)."""
+    cached = not_modified(request, response, data_versions.fountain_validators(fountain_id))
+    if cached:
+        return cached
     fountain = db.query(Fountain).filter(Fountain.id == fountain_id).first()
     if not fountain:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fountain not found")
     
-    reviews = db.query(Review).filter(Review.fountain_id == fountain_id).order_by(Review.creation_date.desc()).all()
-    
-    result = []
-    for review in reviews:
-        review_dict = {
-            "id": review.id,
-            "fountain_id": review.fountain_id,
-            "user_id": review.user_id,
-            "username": None,
-            "creation_date": review.creation_date,
-            "general_rating": review.general_rating,
-            "temp_rating": review.temp_rating,
-            "stream_rating": review.stream_rating,
-            "quenching_rating": review.quenching_rating,
-            "description": review.description,
-            "photos": review.photos
-        }
-        if review.user_id:
-            user = db.query(User).filter(User.id == review.user_id).first()
-            if user:
-                review_dict["username"] = user.username
-        result.append(ReviewResponse(**review_dict))
+    reviews, next_cursor = page_of(
+        db.query(Review).filter(Review.fountain_id == fountain_id),
+        Review.creation_date, Review.id, cursor, limit
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
-    return result
+    usernames = get_usernames(db, (review.user_id for review in reviews))
+    return [review_response(review, usernames) for review in reviews]
 
 
 @app.post("/review", status_code=status.HTTP_201_CREATED)
-async def create_review(
+@query_budget(6)
+def create_review(
     review_data: ReviewCreate,
     db=Depends(get_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
@@ -723,12 +1847,8 @@ async def create_review(
         
         db.add(review)
         
-        # Update fountain's average rating
-        all_reviews = db.query(Review).filter(Review.fountain_id == review_data.fountain_id).all()
-        total_rating = sum(r.general_rating for r in all_reviews) + review.general_rating
-        new_count = len(all_reviews) + 1
-        fountain.average_general_rating = total_rating / new_count
-        fountain.number_of_ratings = new_count
+        # Update the fountain's running rating aggregates
+        apply_review(db, fountain, review)
         fountain.last_updated = datetime.now()
         
         db.commit()
@@ -765,67 +1885,20 @@ async def create_review(
 # ==================== POPULATE ENDPOINT ====================
 
 @app.get("/populate")
-async def populate_db(db=Depends(get_db)):
+def populate_db(update: bool = False, db=Depends(get_db)):
     """Populate database from fountains.csv file."""
-    import csv
-    import ast
-    
-    def extract_coordinates(coord_str):
-        """Extract longitude and latitude from coordinate string."""
-        try:
-            d = json.loads(coord_str.replace("'", '"'))
-        except json.JSONDecodeError:
-            d = ast.literal_eval(coord_str)
-        return d['x'], d['y']
-    
     try:
         # Handle both local and Lambda paths
         csv_path = 'fountains.csv'
         if IS_LAMBDA:
             csv_path = '/var/task/fountains.csv'
         
-        type_converter = {
-            'ברזית גליל': FountainType.cylindrical_fountain,
-            'ברזיית עלה': FountainType.leaf_fountain,
-            'קולר': FountainType.cooler,
-            'ברזיה מרובעת': FountainType.square_fountain,
-            'ברזית פטריה': FountainType.mushroom_fountain
-        }
-        
-        count = 0
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                existing = db.query(Fountain).filter(Fountain.id == int(row['oid'])).first()
-                if existing:
-                    continue
-                
-                longitude, latitude = extract_coordinates(row['coordinates'])
-                
-                # Handle dog_friendly - can be 'True', 'False', 'Yes', 'No', 1, 0
-                dog_friendly_val = row.get('dog_friendly', 'False')
-                if isinstance(dog_friendly_val, str):
-                    dog_friendly = dog_friendly_val.lower() in ('true', 'yes', '1')
-                else:
-                    dog_friendly = bool(dog_friendly_val)
-                
-                fountain = Fountain(
-                    id=int(row['oid']),
-                    type=type_converter.get(row['fountain_type'], FountainType.cylindrical_fountain),
-                    address=row['open_map_address'],
-                    latitude=latitude,
-                    longitude=longitude,
-                    dog_friendly=dog_friendly,
-                    bottle_refill=False,
-                    average_general_rating=0,
-                    number_of_ratings=0,
-                    last_updated=datetime.now()
-                )
-                db.add(fountain)
-                count += 1
-        
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            report = import_fountains(db, f, update_existing=update, shards=shard_set)
         db.commit()
-        return {"message": f"Successfully populated {count} fountains"}
+        build_fountain_index()
+        print(f"Imported fountains: {json.dumps(report)}")
+        return {"message": f"Successfully populated {report['inserted']} fountains", **report}
     
     except FileNotFoundError:
         raise HTTPException(
@@ -843,7 +1916,7 @@ async def populate_db(db=Depends(get_db)):
 # ==================== DATABASE INIT (Lambda) ====================
 
 @app.get("/init-db")
-async def init_database():
+def init_database():
     """Initialize database tables (for Lambda deployment)."""
     try:
         SQLModel.metadata.create_all(engine)
@@ -856,13 +1929,25 @@ async def init_database():
 
 
 @app.get("/reset-db")
-async def reset_database():
+def reset_database():
     """Drop and recreate all database tables. WARNING: This deletes all data!"""
     try:
+        if shard_set is not None:
+            # Shards are emptied in place; their files stay where they are
+            for name in shard_set.names():
+                shard_engine = shard_set.engines(name)[0]
+                SQLModel.metadata.drop_all(shard_engine, tables=SHARDED_TABLES)
+                SQLModel.metadata.create_all(shard_engine, tables=SHARDED_TABLES)
+            shard_set.reset()
         # Drop all tables
         SQLModel.metadata.drop_all(engine)
         # Recreate all tables with current schema
         SQLModel.metadata.create_all(engine)
+        fountain_index.clear()
+        fountain_counts_cache.clear()
+        data_versions.bump_all()
+        username_cache.clear()
+        user_cache.clear()
         # Save to S3 if on Lambda
         save_lambda_db()
         return {"message": "Database reset successfully - all tables recreated"}
@@ -875,6 +1960,12 @@ async def reset_database():
 
 # ==================== HEALTH CHECK ====================
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Request metrics in the Prometheus text format."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -882,10 +1973,15 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "environment": ENVIRONMENT,
-        "is_lambda": IS_LAMBDA
+        "is_lambda": IS_LAMBDA,
+        "auth_cache": auth_cache_stats()
     }
 
 
+_cold_start_phase("app")
+_log_cold_start()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
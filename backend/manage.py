@@ -0,0 +1,129 @@
+# manage.py - Offline maintenance commands for the Berez database
+#
+# Usage: python manage.py <command>
+
+import argparse
+import time
+
+
+def recompute_aggregates(args):
+    """Rebuild every fountain's rating aggregates from its reviews."""
+    from sqlalchemy.orm import Session
+    from main import SessionLocal, shard_set
+    from aggregates import recompute_all
+
+    started = time.perf_counter()
+    if shard_set is None:
+        with SessionLocal() as db:
+            count = recompute_all(db)
+            db.commit()
+    else:
+        # Reviews and aggregates of a fountain share its shard, so each is done on its own
+        count = 0
+        for name in shard_set.names():
+            with Session(shard_set.engines(name)[0]) as db:
+                count += recompute_all(db)
+                db.commit()
+    print(f"Recomputed rating aggregates for {count} fountains in {time.perf_counter() - started:.2f}s")
+
+
+def import_csv(args):
+    """Stream fountains from a municipal CSV file into the database."""
+    from main import SessionLocal, shard_set
+    from importer import import_fountains
+
+    with SessionLocal() as db, open(args.path, 'r', encoding='utf-8', newline='') as f:
+        report = import_fountains(
+            db, f, update_existing=args.update, batch_size=args.batch_size, shards=shard_set
+        )
+        db.commit()
+    print(
+        f"Imported {report['rows']} rows in {report['seconds']}s "
+        f"({report['rows_per_second']} rows/s): inserted={report['inserted']} "
+        f"updated={report['updated']} skipped={report['skipped']} invalid={report['invalid']}"
+    )
+
+
+def generate_variants(args):
+    """Create resized variants for photos uploaded before they existed."""
+    from main import SessionLocal, photo_processor, photo_is_ready
+    from models import Photo
+
+    with SessionLocal() as db:
+        pending = db.query(Photo.id, Photo.filename).filter(
+            Photo.variants.is_(None), photo_is_ready()
+        ).all()
+    done = 0
+    for photo_id, filename in pending:
+        try:
+            photo_processor.process(photo_id, filename)
+            done += 1
+        except Exception as e:
+            print(f"Skipped photo {photo_id}: {e}")
+    print(f"Generated variants for {done} of {len(pending)} photos")
+
+
+def expire_uploads(args):
+    """Delete pending photos whose presigned upload was never confirmed, with their files."""
+    from main import SessionLocal, expire_pending_photos, shard_set
+
+    if shard_set is not None:
+        # Sweeps only cover open shards
+        for name in shard_set.names():
+            shard_set.engines(name)
+    total = 0
+    with SessionLocal() as db:
+        while True:
+            expired = expire_pending_photos(db)
+            if not expired:
+                break
+            total += expired
+    print(f"Expired {total} abandoned photo uploads")
+
+
+def shard_db(args):
+    """Move fountains stored in berez.db into region shards (run with DB_SHARDING=region)."""
+    from main import engine, shard_set
+    from shards import split_core
+
+    if shard_set is None:
+        raise SystemExit("Set DB_SHARDING=region to split the database into region shards")
+    started = time.perf_counter()
+    moved = split_core(shard_set, engine)
+    for name, count in sorted(moved.items()):
+        print(f"  {name}: {count} fountains")
+    print(f"Moved {sum(moved.values())} fountains into {len(moved)} shards in {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Berez database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "recompute-aggregates", help=recompute_aggregates.__doc__
+    ).set_defaults(handler=recompute_aggregates)
+
+    commands.add_parser(
+        "generate-variants", help=generate_variants.__doc__
+    ).set_defaults(handler=generate_variants)
+
+    commands.add_parser(
+        "expire-uploads", help=expire_uploads.__doc__
+    ).set_defaults(handler=expire_uploads)
+
+    commands.add_parser(
+        "shard-db", help=shard_db.__doc__
+    ).set_defaults(handler=shard_db)
+
+    importer = commands.add_parser("import-csv", help=import_csv.__doc__)
+    importer.add_argument("path", help="CSV file in the fountains.csv format")
+    importer.add_argument("--update", action="store_true", help="Refresh fountains that already exist")
+    importer.add_argument("--batch-size", type=int, default=5000)
+    importer.set_defaults(handler=import_csv)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# metrics.py - Request metrics: per-route latency histograms, phases, Prometheus text
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+# Upper bounds (seconds) of the latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds (bytes) of the payload size buckets
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Seconds spent per named phase in the current request (None outside requests)
+_request_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_phases", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**values) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in values.items())
+
+
+class Metrics:
+    """Process-wide request metrics, rendered in the Prometheus text format.
+
+    On Lambda every instance only sees its own requests, so `log_requests`
+    additionally prints one JSON line per request for CloudWatch.
+    """
+
+    def __init__(self, log_requests: bool = False):
+        self.log_requests = log_requests
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self._request_size: Dict[Tuple[str, str], Histogram] = {}
+        self._response_size: Dict[Tuple[str, str], Histogram] = {}
+        self._phases: Dict[Tuple[str, str], Histogram] = {}
+        self._background: Dict[str, Histogram] = {}
+
+    @staticmethod
+    def _histogram(table: dict, key, bounds) -> Histogram:
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(bounds)
+        return histogram
+
+    def record_request(
+        self,
+        method: str,
+        route: str,
+        status_code: int,
+        seconds: float,
+        request_bytes: int,
+        response_bytes: int,
+        phases: Dict[str, float],
+    ):
+        key = (method, route)
+        with self._lock:
+            status_key = (method, route, status_code)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            self._histogram(self._latency, key, LATENCY_BUCKETS).observe(seconds)
+            self._histogram(self._request_size, key, SIZE_BUCKETS).observe(request_bytes)
+            self._histogram(self._response_size, key, SIZE_BUCKETS).observe(response_bytes)
+            for phase, phase_seconds in phases.items():
+                self._histogram(self._phases, (route, phase), LATENCY_BUCKETS).observe(phase_seconds)
+        if self.log_requests:
+            print(json.dumps({
+                "type": "request",
+                "method": method,
+                "route": route,
+                "status": status_code,
+                "duration_ms": round(seconds * 1000, 2),
+                "request_bytes": request_bytes,
+                "response_bytes": response_bytes,
+                "phases_ms": {name: round(value * 1000, 2) for name, value in phases.items()},
+            }))
+
+    def record_background(self, task: str, seconds: float):
+        """Time spent outside any request (S3 uploads, photo processing, ...)."""
+        with self._lock:
+            self._histogram(self._background, task, LATENCY_BUCKETS).observe(seconds)
+        if self.log_requests:
+            print(json.dumps({"type": "background", "task": task, "duration_ms": round(seconds * 1000, 2)}))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        out = []
+        with self._lock:
+            out.append("# HELP berez_requests_total HTTP requests by route and status.")
+            out.append("# TYPE berez_requests_total counter")
+            for (method, route, status_code), count in sorted(self._requests.items()):
+                out.append(f"berez_requests_total{{{_labels(method=method, route=route, status=status_code)}}} {count}")
+
+            for name, help_text, table in (
+                ("berez_request_duration_seconds", "Request latency by route.", self._latency),
+                ("berez_request_size_bytes", "Request body size by route.", self._request_size),
+                ("berez_response_size_bytes", "Response body size by route.", self._response_size),
+            ):
+                out.append(f"# HELP {name} {help_text}")
+                out.append(f"# TYPE {name} histogram")
+                for (method, route), histogram in sorted(table.items()):
+                    out.extend(histogram.lines(name, _labels(method=method, route=route)))
+
+            out.append("# HELP berez_request_phase_seconds Time per request spent in a phase (db, auth, photo_storage, s3_sync).")
+            out.append("# TYPE berez_request_phase_seconds histogram")
+            for (route, phase), histogram in sorted(self._phases.items()):
+                out.extend(histogram.lines("berez_request_phase_seconds", _labels(route=route, phase=phase)))
+
+            out.append("# HELP berez_background_seconds Duration of work done outside requests.")
+            out.append("# TYPE berez_background_seconds histogram")
+            for task, histogram in sorted(self._background.items()):
+                out.extend(histogram.lines("berez_background_seconds", _labels(task=task)))
+        return "\n".join(out) + "\n"
+
+
+def add_phase_time(name: str, seconds: float) -> bool:
+    """Add time to a phase of the current request; False outside a request."""
+    phases = _request_phases.get()
+    if phases is None:
+        return False
+    phases[name] = phases.get(name, 0.0) + seconds
+    return True
+
+
+@contextmanager
+def phase(metrics: Metrics, name: str):
+    """Time a block as a request phase, or as background work outside requests."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if not add_phase_time(name, elapsed):
+            metrics.record_background(name, elapsed)
+
+
+def track_engine(engine):
+    """Count time spent executing SQL as the "db" phase of the running request."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("metrics_started")
+        add_phase_time("db", time.perf_counter() - started)
+
+
+def route_label(scope) -> str:
+    """Path template of the route that handled the request."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        # A mounted app (e.g. /uploads) only leaves its prefix in root_path
+        mount = scope.get("root_path", "")[len(scope.get("app_root_path", "")):]
+        return f"{mount}/{{path}}"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording every HTTP request into `metrics`.
+
+    Routes are labelled by their path template (e.g. /fountains/{fountain_id}),
+    so label cardinality stays bounded.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        phases: Dict[str, float] = {}
+        token = _request_phases.set(phases)
+        started = time.perf_counter()
+        status_code = 500
+        sizes = {"request": 0, "response": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            _request_phases.reset(token)
+            self.metrics.record_request(
+                scope["method"], route_label(scope), status_code, time.perf_counter() - started,
+                sizes["request"], sizes["response"], phases,
+            )
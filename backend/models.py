@@ -1,9 +1,12 @@
 import enum
-from typing import Optional, List
+from typing import Dict, Optional, List
 
+from sqlalchemy import Index, event
 from sqlmodel import Field, SQLModel, Column, JSON, Relationship
 from datetime import date, datetime
 
+from spatial import grid_cell
+
 
 class FountainType(enum.Enum):
     cylindrical_fountain = 1
@@ -88,15 +91,29 @@ class Fountain(SQLModel, table=True):
     status: str = Field(default="verified")  # verified, user_submitted, approved
     submitted_by: Optional[int] = Field(default=None, foreign_key='user.id')
     description: Optional[str] = Field(default=None, max_length=500)
+    grid_cell: Optional[int] = Field(default=None, index=True)  # spatial.grid_cell of the coordinates
+
+
+@event.listens_for(Fountain, "before_insert")
+@event.listens_for(Fountain, "before_update")
+def _set_grid_cell(mapper, connection, fountain):
+    """Keep the spatial key in step with the coordinates on every ORM write."""
+    fountain.grid_cell = grid_cell(fountain.longitude, fountain.latitude)
 
 
 class Photo(SQLModel, table=True):
     """Photo model for storing uploaded images."""
+    # Keyset pagination of a fountain's photos, newest first
+    __table_args__ = (Index("ix_photo_fountain_created", "fountain_id", "created_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     filename: str
     original_filename: str
     content_type: str
     file_size: int
+    content_hash: Optional[str] = Field(default=None, index=True)  # sha256 hex digest
+    variants: Optional[Dict[str, str]] = Field(sa_column=Column(JSON(none_as_null=True)), default=None)  # width -> filename
+    status: Optional[str] = Field(default="ready", index=True)  # pending (presigned, not uploaded yet), ready
     uploaded_by: Optional[int] = Field(default=None, foreign_key='user.id')
     fountain_id: Optional[int] = Field(default=None, foreign_key='fountain.id', index=True)
     review_id: Optional[int] = Field(default=None, foreign_key='review.id', index=True)
@@ -105,6 +122,9 @@ class Photo(SQLModel, table=True):
 
 class Review(SQLModel, table=True):
     """Review model for fountain ratings."""
+    # Keyset pagination of a fountain's reviews, newest first
+    __table_args__ = (Index("ix_review_fountain_created", "fountain_id", "creation_date", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     fountain_id: int = Field(index=True, foreign_key='fountain.id')
     user_id: Optional[int] = Field(default=None, foreign_key='user.id', index=True)
@@ -117,6 +137,50 @@ class Review(SQLModel, table=True):
     photos: Optional[List[int]] = Field(sa_column=Column(JSON), default=None)
 
 
+class FountainStats(SQLModel, table=True):
+    """Running rating aggregates per fountain, updated in place on every review."""
+    fountain_id: int = Field(primary_key=True, foreign_key='fountain.id')
+    general_sum: int = Field(default=0)
+    general_count: int = Field(default=0)
+    temp_sum: int = Field(default=0)
+    temp_count: int = Field(default=0)
+    stream_sum: int = Field(default=0)
+    stream_count: int = Field(default=0)
+    quenching_sum: int = Field(default=0)
+    quenching_count: int = Field(default=0)
+    # Histogram of general ratings
+    general_1: int = Field(default=0)
+    general_2: int = Field(default=0)
+    general_3: int = Field(default=0)
+    general_4: int = Field(default=0)
+    general_5: int = Field(default=0)
+
+
+# Routing index of region shards (DB_SHARDING=region), kept in the core database
+
+class ShardRegion(SQLModel, table=True):
+    """A region shard and the bounds of every fountain ever stored in it."""
+    name: str = Field(primary_key=True)
+    min_longitude: float
+    min_latitude: float
+    max_longitude: float
+    max_latitude: float
+
+
+class FountainRoute(SQLModel, table=True):
+    """The shard holding a fountain, with the fields fountain totals are counted by."""
+    fountain_id: int = Field(primary_key=True)
+    shard: str = Field(index=True)
+    status: str = Field(default="verified")
+    type: Optional[FountainType] = None
+
+
+class PhotoRoute(SQLModel, table=True):
+    """The shard holding a photo; photos without a fountain stay in the core database."""
+    photo_id: int = Field(primary_key=True)
+    shard: str
+
+
 class ReviewCreate(SQLModel):
     """Schema for creating a review."""
     fountain_id: int
@@ -160,6 +224,9 @@ class ReportStatus(enum.Enum):
 
 class FountainReport(SQLModel, table=True):
     """User reports for fountain issues."""
+    # Keyset pagination of a fountain's reports, newest first
+    __table_args__ = (Index("ix_fountainreport_fountain_created", "fountain_id", "created_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     fountain_id: int = Field(index=True, foreign_key='fountain.id')
     user_id: Optional[int] = Field(default=None, foreign_key='user.id', index=True)
@@ -206,3 +273,11 @@ class FountainCreate(SQLModel):
     bottle_refill: bool = False
     type: FountainType
     description: Optional[str] = Field(default=None, max_length=500)
+
+
+class PhotoUploadRequest(SQLModel):
+    """Schema for requesting a direct-to-storage photo upload."""
+    filename: str = Field(max_length=255)
+    content_type: Optional[str] = None
+    file_size: int = Field(gt=0)
+    fountain_id: Optional[int] = None
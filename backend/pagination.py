@@ -0,0 +1,46 @@
+# pagination.py - Keyset (cursor) pagination over (timestamp, id), newest first
+
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+# Default and maximum page sizes for list endpoints
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created: datetime, row_id: int) -> str:
+    """Opaque cursor pointing just past a row."""
+    raw = json.dumps([created.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created, row_id = json.loads(raw)
+        return datetime.fromisoformat(created), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def keyset_page(query, created_column, id_column, cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """One page of `query`, newest first; returns (rows, cursor of the next page or None).
+
+    Rows are ordered by (created_column, id_column) descending and a page
+    starts strictly after the cursor's row, so a composite index on
+    (parent id, created_column, id_column) serves every page with a single
+    index seek, however deep. Rows inserted meanwhile never shift a page.
+    """
+    if cursor is not None:
+        query = query.filter(tuple_(created_column, id_column) < decode_cursor(cursor))
+    rows = query.order_by(created_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit or not limit:
+        return rows[:limit], None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, created_column.key), getattr(last, id_column.key))
@@ -0,0 +1,284 @@
+# photos.py - Streaming photo storage (local disk or S3)
+
+import hashlib
+import hmac
+import io
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, Tuple
+
+# Bytes read from the request per step; memory per upload stays around this
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# S3 multipart part size (the S3 minimum) and parts in flight per upload
+S3_PART_SIZE = 5 * 1024 * 1024
+S3_UPLOAD_CONCURRENCY = 2
+
+# Widths (px) of the resized copies served to carousels and full screen views
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMAT = "WEBP"
+VARIANT_EXTENSION = ".webp"
+VARIANT_CONTENT_TYPE = "image/webp"
+VARIANT_QUALITY = 80
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded the maximum allowed size."""
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware answering 413 to upload requests with oversized bodies.
+
+    Runs before the multipart parser spools anything: a Content-Length over
+    `max_bytes` is refused without reading the body, and bodies sent without
+    one are counted as they arrive and cut off once they pass the limit.
+    `paths` are path prefixes (after the root path).
+    """
+
+    def __init__(self, app, paths: Tuple[str, ...], max_bytes: int, detail: str):
+        self.app = app
+        self.paths = paths
+        self.max_bytes = max_bytes
+        self.body = json.dumps({"detail": detail}).encode()
+
+    async def _reject(self, send):
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(self.body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": self.body})
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        if scope["type"] != "http" or not path.startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge(f"Request body exceeds {self.max_bytes} bytes")
+            return message
+
+        started = False
+
+        async def limited_send(message):
+            nonlocal started
+            # The app turns the aborted read into some error response; send 413 instead
+            if exceeded:
+                if not started:
+                    started = True
+                    await self._reject(send)
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except UploadTooLarge:
+            if not started:
+                await self._reject(send)
+
+
+class HashingReader:
+    """File-like wrapper that counts and hashes bytes as they are read.
+
+    Raises UploadTooLarge as soon as more than `max_size` bytes have been
+    read, so oversized uploads are abandoned without being buffered.
+    """
+
+    def __init__(self, source: BinaryIO, max_size: int):
+        self.source = source
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.source.read(UPLOAD_CHUNK_SIZE if size is None or size < 0 else size)
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise UploadTooLarge()
+        self._hash.update(chunk)
+        return chunk
+
+    @property
+    def content_hash(self) -> str:
+        return self._hash.hexdigest()
+
+
+def save_local(source: BinaryIO, path: Path, max_size: int) -> Tuple[int, str]:
+    """Stream an upload to disk; returns (size, sha256 hex digest)."""
+    reader = HashingReader(source, max_size)
+    partial = path.with_name(path.name + ".part")
+    try:
+        with open(partial, "wb") as f:
+            while True:
+                chunk = reader.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+    return reader.size, reader.content_hash
+
+
+def file_digest(path: Path, max_size: int) -> Tuple[int, str]:
+    """Size and sha256 hex digest of a stored file, read in chunks."""
+    with open(path, "rb") as f:
+        reader = HashingReader(f, max_size)
+        while reader.read(UPLOAD_CHUNK_SIZE):
+            pass
+    return reader.size, reader.content_hash
+
+
+def sign_upload(secret: str, filename: str, expires: int) -> str:
+    """Signature for the local stand-in of a presigned upload URL."""
+    message = f"{filename}:{expires}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_upload(secret: str, filename: str, expires: int, signature: str, now: float) -> bool:
+    return expires >= now and hmac.compare_digest(sign_upload(secret, filename, expires), signature)
+
+
+def save_s3(s3, source: BinaryIO, bucket: str, key: str, content_type: str, max_size: int) -> Tuple[int, str]:
+    """Stream an upload to S3 (multipart above one part); returns (size, sha256 hex digest).
+
+    An oversized upload raises UploadTooLarge mid-stream, which makes boto3
+    abort the multipart upload.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    reader = HashingReader(source, max_size)
+    s3.upload_fileobj(
+        reader, bucket, key,
+        ExtraArgs={"ContentType": content_type},
+        Config=TransferConfig(
+            multipart_threshold=S3_PART_SIZE,
+            multipart_chunksize=S3_PART_SIZE,
+            max_concurrency=S3_UPLOAD_CONCURRENCY,
+        ),
+    )
+    return reader.size, reader.content_hash
+
+
+def render_variants(data: bytes, widths=VARIANT_WIDTHS) -> Dict[int, bytes]:
+    """Resize an image to each width (never upscaling) and encode it as WebP.
+
+    Runs in a worker process. EXIF orientation is applied first; the output
+    carries no EXIF, GPS or other metadata.
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder skip detail we are about to throw away
+    image.draft("RGB", (max(widths), max(widths)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    variants = {}
+    for width in sorted(widths):
+        if variants and width >= image.width:
+            break
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        out = io.BytesIO()
+        resized.save(out, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+        variants[min(width, image.width)] = out.getvalue()
+    return variants
+
+
+class PhotoProcessor:
+    """Generates photo variants after the upload request has been answered.
+
+    Jobs are queued on coordinator threads. The CPU-heavy resizing runs in
+    a process pool when `worker_processes` is set, otherwise in a single
+    coordinator thread. On Lambda the API hands photos to asynchronous
+    invocations, which call `process()` directly. `wait()` lets the Lambda
+    handler finish queued work before the sandbox is frozen.
+    """
+
+    def __init__(
+        self,
+        read_original: Callable[[str], bytes],
+        write_variant: Callable[[str, bytes], None],
+        on_done: Callable[[int, Dict[str, str]], None],
+        worker_processes: int = 0,
+    ):
+        self.read_original = read_original
+        self.write_variant = write_variant
+        self.on_done = on_done
+        self.worker_processes = worker_processes
+        self._queue = ThreadPoolExecutor(
+            max_workers=max(1, worker_processes), thread_name_prefix="photo-variants"
+        )
+        self._pool: Optional[Executor] = None
+        self._pool_lock = threading.Lock()
+        self._pending = 0
+        self._cond = threading.Condition()
+
+    def submit(self, photo_id: int, filename: str):
+        with self._cond:
+            self._pending += 1
+        self._queue.submit(self._process, photo_id, filename)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted photo has been processed (or failed)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def process(self, photo_id: int, filename: str) -> Dict[str, str]:
+        """Render, store and record the variants of one photo; returns width -> filename."""
+        data = self.read_original(filename)
+        if self.worker_processes:
+            with self._pool_lock:
+                if self._pool is None:
+                    # Spawned, not forked: a fork of this multithreaded server can
+                    # copy a lock another thread holds and deadlock the child
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.worker_processes,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+            rendered = self._pool.submit(render_variants, data).result()
+        else:
+            rendered = render_variants(data)
+
+        stem = Path(filename).stem
+        variants = {}
+        for width, content in rendered.items():
+            variant_name = f"{stem}_{width}w{VARIANT_EXTENSION}"
+            self.write_variant(variant_name, content)
+            variants[str(width)] = variant_name
+        self.on_done(photo_id, variants)
+        return variants
+
+    def _process(self, photo_id: int, filename: str):
+        try:
+            self.process(photo_id, filename)
+        except Exception as e:
+            print(f"Failed to generate variants for photo {photo_id}: {e}")
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
@@ -0,0 +1,134 @@
+# querylog.py - Per-request SQL query counts, query budgets and a slow-query log
+
+import json
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from metrics import route_label
+
+# Statements seen by the current request (None outside requests)
+_request_queries: ContextVar[Optional["QueryStats"]] = ContextVar("request_queries", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """A route ran more queries than its declared budget (strict mode only)."""
+
+
+class QueryStats:
+    """SQL statements run while handling one request."""
+
+    __slots__ = ("scope", "count", "seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+
+    @property
+    def budget(self) -> Optional[int]:
+        # Routing fills in the endpoint after the middleware has started
+        return getattr(self.scope.get("endpoint"), "query_budget", None)
+
+
+def query_budget(limit: int):
+    """Declare how many SQL statements one call of an endpoint may run.
+
+    Apply below the route decorator. The budget covers dependencies too
+    (e.g. the current user lookup). Exceeding it is reported in the debug
+    header, and fails the query in strict mode.
+    """
+    def decorate(endpoint):
+        endpoint.query_budget = limit
+        return endpoint
+    return decorate
+
+
+class QueryLog:
+    """Counts queries per request and logs slow ones with their query plan."""
+
+    def __init__(self, slow_query_seconds: Optional[float] = None, strict: bool = False):
+        self.slow_query_seconds = slow_query_seconds
+        self.strict = strict
+
+    def track(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before_execute(conn, cursor, statement, parameters, context, executemany):
+            stats = _request_queries.get()
+            if stats is not None:
+                stats.count += 1
+                budget = stats.budget
+                if self.strict and budget is not None and stats.count > budget:
+                    raise QueryBudgetExceeded(
+                        f"Query {stats.count} exceeds the budget of {budget} for this route: {statement}"
+                    )
+            conn.info["querylog_started"] = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info.pop("querylog_started")
+            stats = _request_queries.get()
+            if stats is not None:
+                stats.seconds += elapsed
+            if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+                self._log_slow(cursor, statement, parameters[0] if executemany else parameters, elapsed)
+
+    def _log_slow(self, cursor, statement: str, parameters, seconds: float):
+        plan = None
+        # Schema changes and pragmas have no plan (and may not be repeatable)
+        if statement.lstrip()[:6].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            try:
+                # Straight on the DBAPI connection, so this is not counted or timed itself
+                plan = [row[-1] for row in cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            except Exception as e:
+                plan = [f"unavailable: {e}"]
+        print(json.dumps({
+            "type": "slow_query",
+            "duration_ms": round(seconds * 1000, 2),
+            "statement": " ".join(statement.split()),
+            "plan": plan,
+        }))
+
+
+class QueryLogMiddleware:
+    """ASGI middleware giving each request its own query counter.
+
+    With `debug_header` set, responses carry
+    `X-Query-Count: <queries>; db=<ms>; budget=<n>`.
+    """
+
+    def __init__(self, app, debug_header: bool = False):
+        self.app = app
+        self.debug_header = debug_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope)
+        token = _request_queries.set(stats)
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                value = f"{stats.count}; db={stats.seconds * 1000:.1f}ms"
+                if stats.budget is not None:
+                    value += f"; budget={stats.budget}"
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-query-count", value.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_header if self.debug_header else send)
+        finally:
+            _request_queries.reset(token)
+            if stats.budget is not None and stats.count > stats.budget:
+                print(json.dumps({
+                    "type": "query_budget_exceeded",
+                    "route": route_label(scope),
+                    "queries": stats.count,
+                    "budget": stats.budget,
+                }))
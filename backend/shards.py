@@ -0,0 +1,508 @@
+# shards.py - Region shards: fountains and the rows attached to them, one SQLite file per region
+
+import math
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BindParameter
+
+from cache import TTLCache
+from models import (
+    Fountain, FountainReport, FountainRoute, FountainStats, Photo, PhotoRoute, Review, ShardRegion
+)
+from spatial import BoundingBox
+
+# The database that is always open: users, the routing index, photos without
+# a fountain, and empty copies of the sharded tables for lookups that match
+# no shard
+CORE_SHARD = "core"
+
+# Tables stored in each region's file
+SHARDED_TABLES = [model.__table__ for model in (Fountain, Review, Photo, FountainReport, FountainStats)]
+_SHARDED_NAMES = {table.name for table in SHARDED_TABLES}
+# Rows that live in the shard of the fountain they belong to
+_BY_FOUNTAIN = {Review.__tablename__, Photo.__tablename__, FountainReport.__tablename__, FountainStats.__tablename__}
+
+# Routes never change once written, so they are only dropped for space
+ROUTE_CACHE_SIZE = 100_000
+ROUTE_CACHE_TTL = 24 * 60 * 60
+
+
+def region_shard(longitude: float, latitude: float, degrees: float) -> str:
+    """Name of the region tile holding a point, e.g. "34_32" for 1° tiles."""
+    return f"{math.floor(longitude / degrees)}_{math.floor(latitude / degrees)}"
+
+
+def shard_path(core_path: Path, name: str) -> Path:
+    """File of a region shard, next to the core database (berez-34_32.db)."""
+    return core_path.with_name(f"{core_path.stem}-{name}{core_path.suffix}")
+
+
+def _overlaps(a: BoundingBox, b: BoundingBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _union(a: Optional[BoundingBox], b: BoundingBox) -> BoundingBox:
+    if a is None:
+        return b
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _extent(rows: List[dict]) -> BoundingBox:
+    return (
+        min(row["longitude"] for row in rows), min(row["latitude"] for row in rows),
+        max(row["longitude"] for row in rows), max(row["latitude"] for row in rows),
+    )
+
+
+def _widen_bounds(name: str, bbox: BoundingBox):
+    """Upsert of a shard's bounds that only ever grows them."""
+    table = ShardRegion.__table__
+    columns = ("min_longitude", "min_latitude", "max_longitude", "max_latitude")
+    statement = insert(table).values(name=name, **dict(zip(columns, bbox)))
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={
+            column: (func.min if column.startswith("min") else func.max)(table.c[column], statement.excluded[column])
+            for column in columns
+        },
+    )
+
+
+class ShardSet:
+    """The region shards next to a core database, opened on first use.
+
+    The core database keeps the routing index: the bounds of every shard
+    (ShardRegion), the shard of every fountain (FountainRoute) and of every
+    photo stored in a shard (PhotoRoute). A shard's file is only opened, by
+    `open_shard` (which on Lambda downloads it first), once a statement is
+    routed to it; `on_open` is then called with its name and engines.
+    """
+
+    def __init__(
+        self,
+        core_engine: Engine,
+        core_read_engine: Optional[Engine],
+        open_shard: Callable[[str], Tuple[Engine, Optional[Engine]]],
+        degrees: float,
+        new_id: Callable[[], int],
+        on_open: Optional[Callable[[str, Engine, Optional[Engine]], None]] = None,
+    ):
+        self.open_shard = open_shard
+        self.degrees = degrees
+        self.new_id = new_id
+        self.on_open = on_open
+        self._core_reader = core_read_engine or core_engine
+        self._engines: Dict[str, Tuple[Engine, Optional[Engine]]] = {
+            CORE_SHARD: (core_engine, core_read_engine)
+        }
+        self._opening: Dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+        self.bounds: Dict[str, BoundingBox] = {}
+        self.fountain_routes = TTLCache(max_size=ROUTE_CACHE_SIZE, ttl_seconds=ROUTE_CACHE_TTL)
+        self.photo_routes = TTLCache(max_size=ROUTE_CACHE_SIZE, ttl_seconds=ROUTE_CACHE_TTL)
+
+    # ---------- shards ----------
+
+    def load(self):
+        """(Re)read the shard bounds from the core database and forget cached routes."""
+        with self._core_reader.connect() as conn:
+            rows = conn.execute(select(
+                ShardRegion.name, ShardRegion.min_longitude, ShardRegion.min_latitude,
+                ShardRegion.max_longitude, ShardRegion.max_latitude
+            )).all()
+        self.bounds = {name: tuple(bounds) for name, *bounds in rows}
+        self.fountain_routes.clear()
+        self.photo_routes.clear()
+
+    def names(self) -> List[str]:
+        """Every region shard in the routing index."""
+        return sorted(self.bounds)
+
+    def opened(self) -> List[str]:
+        """Region shards this process has opened so far."""
+        return sorted(name for name in self._engines if name != CORE_SHARD)
+
+    def covering(self, bbox: BoundingBox) -> List[str]:
+        """Region shards holding fountains that may lie inside a bounding box."""
+        return sorted(name for name, bounds in list(self.bounds.items()) if _overlaps(bounds, bbox))
+
+    def engines(self, name: str) -> Tuple[Engine, Optional[Engine]]:
+        """(write engine, read engine) of a shard, opening it on first use."""
+        engines = self._engines.get(name)
+        if engines is not None:
+            return engines
+        with self._lock:
+            opening = self._opening.setdefault(name, threading.RLock())
+        with opening:
+            engines = self._engines.get(name)
+            if engines is None:
+                engines = self.open_shard(name)
+                self._engines[name] = engines
+                if self.on_open is not None:
+                    self.on_open(name, *engines)
+        return engines
+
+    def open_covering(self, bbox: BoundingBox):
+        """Open every shard that may hold fountains inside a bounding box."""
+        for name in self.covering(bbox):
+            self.engines(name)
+
+    def region_of(self, longitude: float, latitude: float) -> str:
+        return region_shard(longitude, latitude, self.degrees)
+
+    def expand(self, session, name: str, bbox: BoundingBox):
+        """Widen a shard's recorded bounds (creating it) so they hold `bbox`.
+
+        Bounds only ever grow: fountains keep their shard when they move.
+        """
+        bounds = self.bounds.get(name)
+        if bounds is not None and _union(bounds, bbox) == bounds:
+            return
+        session.execute(_widen_bounds(name, bbox), bind_arguments={"shard_id": CORE_SHARD})
+        # Wider than committed bounds only costs a needless lookup, so no need to wait
+        self.bounds[name] = _union(bounds, bbox)
+
+    # ---------- routes ----------
+
+    def _routes(self, session, route, ids: Iterable[int]) -> Dict[int, str]:
+        """Shards of the given ids in a route table: this session's new routes, the cache, then core."""
+        kind, cache = (
+            ("fountain", self.fountain_routes) if route is FountainRoute else ("photo", self.photo_routes)
+        )
+        id_column = list(route.__table__.primary_key)[0]
+        ids = {i for i in ids if i is not None}
+        pending = session.info.get("pending_routes", {})
+        found = {i: pending[(kind, i)] for i in ids if (kind, i) in pending}
+        found.update(cache.get_many(ids - set(found)))
+        missing = ids - set(found)
+        if missing:
+            with self._core_reader.connect() as conn:
+                rows = conn.execute(select(id_column, route.__table__.c.shard).where(id_column.in_(missing)))
+                for row_id, shard in rows:
+                    cache.set(row_id, shard)
+                    found[row_id] = shard
+        return found
+
+    def fountain_shards(self, session, fountain_ids: Iterable[int]) -> Dict[int, str]:
+        """Shard of each of the given fountains that exists."""
+        return self._routes(session, FountainRoute, fountain_ids)
+
+    def photo_shards(self, session, photo_ids: Iterable[int]) -> Dict[int, str]:
+        """Shard of each of the given photos stored in a region shard."""
+        return self._routes(session, PhotoRoute, photo_ids)
+
+    def _fountain_shard(self, session, fountain_id: Optional[int]) -> str:
+        return self.fountain_shards(session, [fountain_id]).get(fountain_id, CORE_SHARD)
+
+    def _remember(self, session, key: str, row_id: int, shard: str):
+        session.info.setdefault("pending_routes", {})[(key, row_id)] = shard
+
+    def place_fountains(self, session, rows: List[dict]) -> Dict[str, List[dict]]:
+        """Group fountain rows for a bulk insert by shard, recording routes for new ones.
+
+        Existing fountains keep their shard and new ones go to their region.
+        The caller executes each group with bind_arguments={"shard_id": shard}.
+        """
+        known = self.fountain_shards(session, [row["id"] for row in rows])
+        placed: Dict[str, List[dict]] = {}
+        for row in rows:
+            shard = known.get(row["id"]) or self.region_of(row["longitude"], row["latitude"])
+            placed.setdefault(shard, []).append(row)
+        for shard, group in placed.items():
+            self.expand(session, shard, _extent(group))
+        table = FountainRoute.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.fountain_id], set_={"type": statement.excluded.type}
+        )
+        session.execute(statement, [
+            {"fountain_id": row["id"], "shard": shard, "status": row.get("status", "verified"), "type": row["type"]}
+            for shard, group in placed.items()
+            for row in group
+        ], bind_arguments={"shard_id": CORE_SHARD})
+        for shard, group in placed.items():
+            for row in group:
+                self._remember(session, "fountain", row["id"], shard)
+        return placed
+
+    def register_flush(self, session):
+        """Route rows about to be flushed, and keep the routing index in step with them."""
+        for obj in list(session.new):
+            if isinstance(obj, Fountain):
+                if obj.id is None:
+                    obj.id = self.new_id()
+                shard = self.region_of(obj.longitude, obj.latitude)
+                session.add(FountainRoute(fountain_id=obj.id, shard=shard, status=obj.status, type=obj.type))
+                self._remember(session, "fountain", obj.id, shard)
+                self.expand(session, shard, (obj.longitude, obj.latitude, obj.longitude, obj.latitude))
+            elif isinstance(obj, Photo) and obj.fountain_id is not None:
+                shard = self._fountain_shard(session, obj.fountain_id)
+                if shard != CORE_SHARD:
+                    if obj.id is None:
+                        obj.id = self.new_id()
+                    session.add(PhotoRoute(photo_id=obj.id, shard=shard))
+                    self._remember(session, "photo", obj.id, shard)
+        for obj in session.dirty:
+            if not isinstance(obj, Fountain) or obj.id is None:
+                continue
+            state = inspect(obj)
+            if state.key is None:
+                continue
+            changed = {name for name in ("longitude", "latitude", "status", "type")
+                       if state.attrs[name].history.has_changes()}
+            if changed & {"longitude", "latitude"}:
+                self.expand(session, state.key[2], (obj.longitude, obj.latitude, obj.longitude, obj.latitude))
+            if changed & {"status", "type"}:
+                session.execute(
+                    update(FountainRoute).where(FountainRoute.fountain_id == obj.id)
+                    .values(status=obj.status, type=obj.type),
+                    bind_arguments={"shard_id": CORE_SHARD}
+                )
+        for obj in session.deleted:
+            if isinstance(obj, Fountain) and obj.id is not None:
+                session.execute(
+                    FountainRoute.__table__.delete().where(FountainRoute.fountain_id == obj.id),
+                    bind_arguments={"shard_id": CORE_SHARD}
+                )
+
+    def commit_routes(self, session):
+        for (key, row_id), shard in session.info.pop("pending_routes", {}).items():
+            (self.fountain_routes if key == "fountain" else self.photo_routes).set(row_id, shard)
+
+    def reset(self):
+        """Forget every shard's bounds and routes (after the core database was emptied)."""
+        self.bounds = {}
+        self.fountain_routes.clear()
+        self.photo_routes.clear()
+
+    # ---------- choosers ----------
+
+    def shard_for_instance(self, session, mapper, instance) -> str:
+        """Shard a new object is inserted into."""
+        if instance is None:
+            return CORE_SHARD
+        if isinstance(instance, Fountain):
+            return self.region_of(instance.longitude, instance.latitude)
+        if mapper.local_table.name in _BY_FOUNTAIN:
+            return self._fountain_shard(session, instance.fountain_id)
+        return CORE_SHARD
+
+    def shards_for_identity(self, session, mapper, primary_key) -> List[str]:
+        """Shards to look for a row in by primary key."""
+        table = mapper.local_table.name
+        if table in (Fountain.__tablename__, FountainStats.__tablename__):
+            return [self._fountain_shard(session, primary_key[0])]
+        if table == Photo.__tablename__:
+            return [self.photo_shards(session, [primary_key[0]]).get(primary_key[0], CORE_SHARD)]
+        if table in _SHARDED_NAMES:
+            return [CORE_SHARD] + self.names()
+        return [CORE_SHARD]
+
+    def shards_for_statement(self, orm_context) -> List[str]:
+        """Shards a statement runs on, from the fountain/photo ids or bounding box it filters by.
+
+        The routing criteria must not be OR-ed with others. A statement on
+        sharded tables without any runs on every shard (on those already
+        open with the `open_shards_only` execution option); plain INSERTs go
+        where their rows belong and must not span shards.
+        """
+        statement = orm_context.statement
+        session = orm_context.session
+        tables = set()
+        fountain_ids, photo_ids = set(), set()
+        keyed = False
+        bbox = [-180.0, -90.0, 180.0, 90.0]
+        bounded = False
+
+        # Session.get() passes the primary key as a parameter rather than in the statement
+        parameters = orm_context.parameters if isinstance(orm_context.parameters, dict) else {}
+
+        def values_of(binary):
+            param = binary.right
+            if not isinstance(param, BindParameter):
+                return None
+            value = parameters.get(param.key, param.effective_value)
+            if binary.operator is operators.eq:
+                return [value]
+            if binary.operator is operators.in_op and param.expanding:
+                return list(value or [])
+            return None
+
+        def visit_binary(binary):
+            nonlocal keyed, bounded
+            table = getattr(getattr(binary.left, "table", None), "name", None)
+            key = getattr(binary.left, "key", None)
+            if table == Fountain.__tablename__ and key in ("longitude", "latitude") \
+                    and binary.operator is operators.between_op:
+                low, high = (clause.value for clause in binary.right.clauses)
+                axis = 0 if key == "longitude" else 1
+                bbox[axis], bbox[axis + 2] = max(bbox[axis], low), min(bbox[axis + 2], high)
+                bounded = True
+                return
+            values = values_of(binary)
+            if values is None:
+                return
+            if (table == Fountain.__tablename__ and key == "id") or (table in _BY_FOUNTAIN and key == "fountain_id"):
+                fountain_ids.update(values)
+                keyed = True
+            elif table == Photo.__tablename__ and key == "id":
+                photo_ids.update(values)
+                keyed = True
+
+        visitors.traverse(statement, {}, {"binary": visit_binary, "table": lambda table: tables.add(table.name)})
+
+        if not tables & _SHARDED_NAMES:
+            return [CORE_SHARD]
+        if orm_context.is_insert:
+            return [self._insert_shard(session, statement, orm_context.parameters)]
+        if keyed:
+            shards = set(self.fountain_shards(session, fountain_ids).values())
+            shards.update(self.photo_shards(session, photo_ids).values())
+            if len(shards) < len(fountain_ids) + len(photo_ids):
+                # Unrouted ids are unknown fountains, or photos kept in core
+                shards.add(CORE_SHARD)
+            return sorted(shards)
+        if bounded:
+            return self.covering(tuple(bbox)) or [CORE_SHARD]
+        if orm_context.execution_options.get("open_shards_only"):
+            names = self.opened()
+        else:
+            names = self.names()
+        if Photo.__tablename__ in tables:
+            names = [CORE_SHARD] + names
+        return names or [CORE_SHARD]
+
+    def _insert_shard(self, session, statement, parameters) -> str:
+        table = statement.table.name
+        if isinstance(parameters, dict):
+            rows = [parameters]
+        elif parameters:
+            rows = list(parameters)
+        else:
+            rows = [{getattr(column, "key", column): getattr(value, "value", value)
+                     for column, value in (statement._values or {}).items()}]
+        if table == Fountain.__tablename__:
+            known = self.fountain_shards(session, [row.get("id") for row in rows])
+            shards = {known.get(row.get("id")) or self.region_of(row["longitude"], row["latitude"]) for row in rows}
+        elif table in _BY_FOUNTAIN:
+            known = self.fountain_shards(session, [row.get("fountain_id") for row in rows])
+            shards = {known.get(row.get("fountain_id"), CORE_SHARD) for row in rows}
+        else:
+            shards = {CORE_SHARD}
+        if len(shards) > 1:
+            raise ValueError(
+                f"Bulk insert into {table} spans shards {sorted(shards)}; "
+                "execute each shard's rows with bind_arguments={'shard_id': ...}"
+            )
+        return shards.pop()
+
+
+class ShardSession(ShardedSession):
+    """ShardedSession over a ShardSet, splitting reads and writes per shard like RoutingSession."""
+
+    def __init__(self, *args, shards: ShardSet, **kwargs):
+        self.shards = shards
+        super().__init__(
+            *args,
+            shard_chooser=lambda mapper, instance, **kw: shards.shard_for_instance(self, mapper, instance),
+            identity_chooser=lambda mapper, primary_key, **kw: shards.shards_for_identity(self, mapper, primary_key),
+            execute_chooser=shards.shards_for_statement,
+            **kwargs
+        )
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if shard_id is None:
+            shard_id = self._choose_shard_and_assign(mapper, instance=instance, clause=clause)
+        engine, read_engine = self.shards.engines(shard_id)
+        writers = self.info.setdefault("shard_writers", set())
+        if read_engine is None or shard_id in writers:
+            return engine
+        # Anything that is not plainly a SELECT (flushes, DML, raw SQL) writes
+        if self._flushing or not getattr(clause, "is_select", False):
+            writers.add(shard_id)
+            return engine
+        return read_engine
+
+
+@event.listens_for(ShardSession, "before_flush")
+def _route_flush(session, flush_context, instances):
+    session.shards.register_flush(session)
+
+
+@event.listens_for(ShardSession, "after_commit")
+def _commit_routes(session):
+    session.shards.commit_routes(session)
+    session.info.pop("shard_writers", None)
+
+
+@event.listens_for(ShardSession, "after_rollback")
+def _discard_routes(session):
+    session.info.pop("pending_routes", None)
+    session.info.pop("shard_writers", None)
+
+
+def split_core(shards: ShardSet, core_engine: Engine, batch_size: int = 500) -> Dict[str, int]:
+    """Move the fountains of a core database, and every row attached to them, into region shards.
+
+    For databases created before DB_SHARDING=region. Rows are copied into
+    their shard before the routes are written and the core copies deleted,
+    so an interrupted run can simply be repeated. Returns fountains moved
+    per shard.
+    """
+    with core_engine.connect() as conn:
+        fountains = conn.execute(
+            select(Fountain.id, Fountain.longitude, Fountain.latitude)
+        ).all()
+    region = {fountain_id: shards.region_of(longitude, latitude) for fountain_id, longitude, latitude in fountains}
+    ids = list(region)
+    moved: Dict[str, int] = {}
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        with core_engine.connect() as conn:
+            rows = {
+                table: [
+                    dict(row) for row in conn.execute(
+                        select(table).where(_fountain_key(table).in_(batch))
+                    ).mappings()
+                ]
+                for table in SHARDED_TABLES
+            }
+        by_shard: Dict[str, Dict] = {}
+        for table, table_rows in rows.items():
+            for row in table_rows:
+                shard = region[row["id"] if table.name == Fountain.__tablename__ else row["fountain_id"]]
+                by_shard.setdefault(shard, {}).setdefault(table, []).append(row)
+        for shard, tables in by_shard.items():
+            with shards.engines(shard)[0].begin() as conn:
+                for table in SHARDED_TABLES:
+                    if tables.get(table):
+                        conn.execute(insert(table).on_conflict_do_nothing(), tables[table])
+        with core_engine.begin() as conn:
+            for shard, tables in by_shard.items():
+                fountain_rows = tables.get(Fountain.__table__, [])
+                conn.execute(_widen_bounds(shard, _extent(fountain_rows)))
+                conn.execute(insert(FountainRoute.__table__).on_conflict_do_nothing(), [
+                    {"fountain_id": row["id"], "shard": shard, "status": row["status"], "type": row["type"]}
+                    for row in fountain_rows
+                ])
+                photo_rows = tables.get(Photo.__table__)
+                if photo_rows:
+                    conn.execute(insert(PhotoRoute.__table__).on_conflict_do_nothing(), [
+                        {"photo_id": row["id"], "shard": shard} for row in photo_rows
+                    ])
+                moved[shard] = moved.get(shard, 0) + len(fountain_rows)
+            for table in reversed(SHARDED_TABLES):
+                conn.execute(table.delete().where(_fountain_key(table).in_(batch)))
+    shards.load()
+    return moved
+
+
+def _fountain_key(table):
+    return table.c.id if table.name == Fountain.__tablename__ else table.c.fountain_id
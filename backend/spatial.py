@@ -0,0 +1,431 @@
+# spatial.py - In-memory spatial index for fountain lookups
+
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Grid cell size in degrees (~1.1km north-south)
+DEFAULT_CELL_SIZE = 0.01
+
+# Clusters are roughly a quarter of a 256px map tile wide at every zoom level
+CLUSTERS_PER_TILE = 4
+
+# Mean Earth radius used for haversine distances
+EARTH_RADIUS_M = 6_371_008.8
+
+Cell = Tuple[int, int]
+BoundingBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+
+WORLD_BBOX: BoundingBox = (-180.0, -90.0, 180.0, 90.0)
+
+# Persisted grid cells (Fountain.grid_cell) pack a DEFAULT_CELL_SIZE cell as
+# column * GRID_ROWS + row, so every grid column is one contiguous id range
+_GRID_X_OFFSET = math.ceil(180 / DEFAULT_CELL_SIZE)
+_GRID_Y_OFFSET = math.ceil(90 / DEFAULT_CELL_SIZE)
+GRID_ROWS = 2 * _GRID_Y_OFFSET + 1
+
+
+def haversine_m(longitude: float, latitude: float, coords: np.ndarray) -> np.ndarray:
+    """Great-circle distances in meters from a point to an (n, 2) lon/lat array."""
+    lon1, lat1 = math.radians(longitude), math.radians(latitude)
+    lon2 = np.radians(coords[:, 0])
+    lat2 = np.radians(coords[:, 1])
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _grid_xy(longitude: float, latitude: float) -> Cell:
+    x = min(max(math.floor(longitude / DEFAULT_CELL_SIZE), -_GRID_X_OFFSET), _GRID_X_OFFSET)
+    y = min(max(math.floor(latitude / DEFAULT_CELL_SIZE), -_GRID_Y_OFFSET), _GRID_Y_OFFSET)
+    return x + _GRID_X_OFFSET, y + _GRID_Y_OFFSET
+
+
+def grid_cell(longitude: float, latitude: float) -> int:
+    """Integer id of the grid cell holding a point, as stored in Fountain.grid_cell."""
+    x, y = _grid_xy(longitude, latitude)
+    return x * GRID_ROWS + y
+
+
+def grid_cell_ranges(bbox: BoundingBox, max_ranges: int = 32) -> List[Tuple[int, int]]:
+    """Inclusive grid_cell id ranges that together cover a bounding box.
+
+    One range per grid column; wide boxes merge neighbouring columns so there
+    are at most `max_ranges`, at the price of some rows outside the box that
+    the caller's exact coordinate filter drops.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = _grid_xy(min_lon, min_lat)
+    x1, y1 = _grid_xy(max_lon, max_lat)
+    step = -(-(x1 - x0 + 1) // max_ranges)
+    return [
+        (x * GRID_ROWS + y0, min(x + step - 1, x1) * GRID_ROWS + y1)
+        for x in range(x0, x1 + 1, step)
+    ]
+
+
+def search_bbox(longitude: float, latitude: float, distance_m: float) -> BoundingBox:
+    """Smallest lon/lat box holding every point within `distance_m` of a point."""
+    angle = distance_m / EARTH_RADIUS_M
+    min_lat = latitude - math.degrees(angle)
+    max_lat = latitude + math.degrees(angle)
+    if min_lat <= -90 or max_lat >= 90:
+        # The circle holds a pole, so it spans every longitude
+        return (-180.0, max(min_lat, -90.0), 180.0, min(max_lat, 90.0))
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude)))))
+    if longitude - delta_lon < -180 or longitude + delta_lon > 180:
+        # Crosses the antimeridian; a full band is simpler than two boxes
+        return (-180.0, min_lat, 180.0, max_lat)
+    return (longitude - delta_lon, min_lat, longitude + delta_lon, max_lat)
+
+
+def rank_nearest(
+    rows: Iterable[Tuple[int, float, float]],
+    longitude: float,
+    latitude: float,
+    k: int,
+    max_distance_m: Optional[float] = None,
+) -> List[Tuple[int, float]]:
+    """The k closest of (id, longitude, latitude) rows as (id, distance_m), nearest first."""
+    rows = list(rows)
+    if k <= 0 or not rows:
+        return []
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    distances = haversine_m(longitude, latitude, np.array([row[1:3] for row in rows], dtype=np.float64))
+    if max_distance_m is not None:
+        keep = distances <= max_distance_m
+        ids, distances = ids[keep], distances[keep]
+    if len(ids) > k:
+        top = np.argpartition(distances, k - 1)[:k]
+        ids, distances = ids[top], distances[top]
+    order = np.argsort(distances, kind="stable")
+    return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+
+class FountainIndex:
+    """Uniform grid over fountain coordinates for nearest, bbox and cluster lookups.
+
+    Coordinates and ratings live in contiguous NumPy arrays so distances and
+    cluster aggregates are computed in batched operations; the grid only maps
+    cells to fountain ids to narrow down candidates. The index is process-wide:
+    it is built once from the database at startup and kept in sync by the
+    session commit hooks in main.py.
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._lock = threading.RLock()
+        self._reset(0)
+
+    def _reset(self, capacity: int):
+        self._size = 0
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._coords = np.zeros((capacity, 2), dtype=np.float64)  # longitude, latitude
+        self._ratings = np.zeros((capacity, 2), dtype=np.float64)  # average, count
+        self._slots: Dict[int, int] = {}
+        self._cells: Dict[Cell, Set[int]] = {}
+        # Derived data dropped whenever a fountain changes: the occupied cell
+        # extent and the cluster grids per zoom level
+        self._extent: Optional[Tuple[int, int, int, int]] = None
+        self._clusters: Dict[int, Dict[Cell, dict]] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _cell(self, longitude: float, latitude: float) -> Cell:
+        return (
+            math.floor(longitude / self.cell_size),
+            math.floor(latitude / self.cell_size),
+        )
+
+    def build(self, rows: Iterable[Tuple[int, float, float, float, int]]):
+        """Replace the index contents.
+
+        Rows are (id, longitude, latitude, average_rating, number_of_ratings).
+        """
+        rows = list(rows)
+        with self._lock:
+            self._reset(len(rows))
+            for fountain_id, longitude, latitude, rating, rating_count in rows:
+                self._insert(fountain_id, longitude, latitude, rating, rating_count)
+
+    def clear(self):
+        """Remove every fountain from the index."""
+        self.build([])
+
+    def upsert(
+        self,
+        fountain_id: int,
+        longitude: float,
+        latitude: float,
+        rating: float = 0.0,
+        rating_count: int = 0,
+    ):
+        """Add a fountain or update its coordinates and rating in place."""
+        with self._lock:
+            slot = self._slots.get(fountain_id)
+            if slot is None:
+                self._insert(fountain_id, longitude, latitude, rating, rating_count)
+            else:
+                self._unlink_cell(fountain_id, slot)
+                self._coords[slot] = (longitude, latitude)
+                self._ratings[slot] = (rating or 0.0, rating_count or 0)
+                self._cells.setdefault(self._cell(longitude, latitude), set()).add(fountain_id)
+            self._invalidate()
+
+    def remove(self, fountain_id: int):
+        """Remove a fountain if it is indexed."""
+        with self._lock:
+            slot = self._slots.pop(fountain_id, None)
+            if slot is None:
+                return
+            self._unlink_cell(fountain_id, slot)
+            # Keep the arrays dense by moving the last row into the gap
+            last = self._size - 1
+            if slot != last:
+                moved_id = int(self._ids[last])
+                self._ids[slot] = moved_id
+                self._coords[slot] = self._coords[last]
+                self._ratings[slot] = self._ratings[last]
+                self._slots[moved_id] = slot
+            self._size = last
+            self._invalidate()
+
+    def _invalidate(self):
+        self._extent = None
+        self._clusters = {}
+
+    def _insert(
+        self, fountain_id: int, longitude: float, latitude: float, rating: float, rating_count: int
+    ):
+        if self._size == len(self._ids):
+            self._grow()
+        slot = self._size
+        self._ids[slot] = fountain_id
+        self._coords[slot] = (longitude, latitude)
+        self._ratings[slot] = (rating or 0.0, rating_count or 0)
+        self._slots[fountain_id] = slot
+        self._size += 1
+        self._cells.setdefault(self._cell(longitude, latitude), set()).add(fountain_id)
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self._ids))
+        for name in ("_ids", "_coords", "_ratings"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _unlink_cell(self, fountain_id: int, slot: int):
+        cell = self._cell(*self._coords[slot])
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(fountain_id)
+            if not members:
+                del self._cells[cell]
+
+    def _ring(self, center: Cell, radius: int) -> Iterable[Cell]:
+        """Yield the grid cells at exactly `radius` cells from `center`."""
+        cx, cy = center
+        if radius == 0:
+            yield center
+            return
+        for dx in range(-radius, radius + 1):
+            yield (cx + dx, cy - radius)
+            yield (cx + dx, cy + radius)
+        for dy in range(-radius + 1, radius):
+            yield (cx - radius, cy + dy)
+            yield (cx + radius, cy + dy)
+
+    def _clearance_m(self, radius: int, latitude: float) -> float:
+        """Lower bound on the distance to any fountain outside `radius` rings.
+
+        Such a fountain is at least `radius` cells away along one axis. The
+        longitude axis is the shorter one; it is measured at the poleward edge
+        of the searched square and shaved by 1% to absorb the flat-grid error.
+        """
+        offset = radius * self.cell_size
+        poleward = min(abs(latitude) + offset, 90.0)
+        return 0.99 * EARTH_RADIUS_M * math.radians(offset) * math.cos(math.radians(poleward))
+
+    def _radius_for(self, distance_m: float, latitude: float, max_radius: int) -> int:
+        """Smallest ring radius (capped at max_radius) that clears `distance_m`."""
+        radius = 0
+        while radius < max_radius and self._clearance_m(radius, latitude) < distance_m:
+            radius += 1
+        return radius
+
+    def nearest(
+        self,
+        longitude: float,
+        latitude: float,
+        k: int,
+        max_distance_m: Optional[float] = None,
+    ) -> List[Tuple[int, float]]:
+        """Return up to k (id, distance_m) pairs closest to a point, nearest first."""
+        with self._lock:
+            if k <= 0 or self._size == 0:
+                return []
+
+            if self._extent is None:
+                xs = [cell[0] for cell in self._cells]
+                ys = [cell[1] for cell in self._cells]
+                self._extent = (min(xs), min(ys), max(xs), max(ys))
+            min_x, min_y, max_x, max_y = self._extent
+            center = self._cell(longitude, latitude)
+            max_radius = max(
+                abs(center[0] - min_x), abs(center[0] - max_x),
+                abs(center[1] - min_y), abs(center[1] - max_y),
+            )
+            # Past this radius the search square spans more cells than the grid
+            # has occupied cells, and scanning every row is cheaper than walking
+            # empty cells.
+            scan_radius = math.isqrt(len(self._cells)) // 2 + 1
+            if max_distance_m is not None:
+                max_radius = self._radius_for(max_distance_m, latitude, min(max_radius, scan_radius))
+            target = max_radius
+
+            candidates: List[int] = []
+            radius = 0
+            while True:
+                if radius >= scan_radius:
+                    return self._rank(np.arange(self._size), longitude, latitude, k, max_distance_m)
+                for cell in self._ring(center, radius):
+                    candidates.extend(self._slots[i] for i in self._cells.get(cell, ()))
+                if radius >= target:
+                    break
+                if target == max_radius and len(candidates) >= k:
+                    # Rings beyond the one that clears the current k-th distance
+                    # cannot hold anything closer, so stop there.
+                    ranked = self._rank(np.array(candidates), longitude, latitude, k, max_distance_m)
+                    if len(ranked) == k:
+                        target = self._radius_for(ranked[-1][1], latitude, max_radius)
+                        if target <= radius:
+                            return ranked
+                radius += 1
+
+            return self._rank(np.array(candidates, dtype=np.int64), longitude, latitude, k, max_distance_m)
+
+    def _rank(
+        self,
+        slots: np.ndarray,
+        longitude: float,
+        latitude: float,
+        k: int,
+        max_distance_m: Optional[float],
+    ) -> List[Tuple[int, float]]:
+        """Compute distances for candidate rows in one batch and keep the k closest."""
+        if len(slots) == 0:
+            return []
+        distances = haversine_m(longitude, latitude, self._coords[slots])
+        if max_distance_m is not None:
+            keep = distances <= max_distance_m
+            slots, distances = slots[keep], distances[keep]
+        if len(slots) > k:
+            top = np.argpartition(distances, k - 1)[:k]
+            slots, distances = slots[top], distances[top]
+        order = np.argsort(distances, kind="stable")
+        return list(zip(self._ids[slots[order]].tolist(), distances[order].tolist()))
+
+    def within(self, bbox: BoundingBox, limit: Optional[int] = None) -> List[int]:
+        """Return the ids of fountains inside a bounding box."""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        with self._lock:
+            slots = [
+                self._slots[fountain_id]
+                for cell in _cells_in_bbox(self._cells, self._cell, bbox)
+                for fountain_id in self._cells[cell]
+            ]
+            if not slots:
+                return []
+            slots = np.array(slots)
+            coords = self._coords[slots]
+            inside = (
+                (coords[:, 0] >= min_lon) & (coords[:, 0] <= max_lon)
+                & (coords[:, 1] >= min_lat) & (coords[:, 1] <= max_lat)
+            )
+            return self._ids[slots[inside]][:limit].tolist()
+
+    def clusters(self, zoom: int, bbox: BoundingBox) -> List[dict]:
+        """Return the grid clusters for a zoom level that overlap a bounding box."""
+        with self._lock:
+            grid = self._clusters.get(zoom)
+            if grid is None:
+                grid = self._clusters[zoom] = self._build_clusters(zoom)
+            cell_size = cluster_cell_size(zoom)
+
+            def to_cell(longitude: float, latitude: float) -> Cell:
+                return (math.floor(longitude / cell_size), math.floor(latitude / cell_size))
+
+            return [grid[cell] for cell in _cells_in_bbox(grid, to_cell, bbox)]
+
+    def _build_clusters(self, zoom: int) -> Dict[Cell, dict]:
+        """Group every fountain into the cluster grid for a zoom level."""
+        if self._size == 0:
+            return {}
+        coords = self._coords[:self._size]
+        ratings = self._ratings[:self._size]
+        cells = np.floor(coords / cluster_cell_size(zoom)).astype(np.int64)
+        keys, first, inverse, counts = np.unique(
+            cells, axis=0, return_index=True, return_inverse=True, return_counts=True
+        )
+        inverse = inverse.reshape(-1)
+        lon_sums = np.bincount(inverse, weights=coords[:, 0])
+        lat_sums = np.bincount(inverse, weights=coords[:, 1])
+        rating_sums = np.bincount(inverse, weights=ratings[:, 0] * ratings[:, 1])
+        rating_counts = np.bincount(inverse, weights=ratings[:, 1])
+
+        grid = {}
+        for i, (x, y) in enumerate(keys.tolist()):
+            count = int(counts[i])
+            grid[(x, y)] = {
+                "count": count,
+                "longitude": float(lon_sums[i] / count),
+                "latitude": float(lat_sums[i] / count),
+                "average_rating": (
+                    float(rating_sums[i] / rating_counts[i]) if rating_counts[i] else None
+                ),
+                # Lets the client link single-fountain clusters straight to the fountain
+                "fountain_id": int(self._ids[first[i]]) if count == 1 else None,
+            }
+        return grid
+
+
+def cluster_cell_size(zoom: int) -> float:
+    """Width in degrees of a cluster cell at a web-map zoom level."""
+    return 360.0 / (2 ** zoom) / CLUSTERS_PER_TILE
+
+
+def cluster_bbox(zoom: int, bbox: BoundingBox) -> BoundingBox:
+    """The area covered by the cluster cells that overlap a bounding box."""
+    cell_size = cluster_cell_size(zoom)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return (
+        math.floor(min_lon / cell_size) * cell_size,
+        math.floor(min_lat / cell_size) * cell_size,
+        (math.floor(max_lon / cell_size) + 1) * cell_size,
+        (math.floor(max_lat / cell_size) + 1) * cell_size,
+    )
+
+
+def _cells_in_bbox(occupied: Dict[Cell, object], to_cell, bbox: BoundingBox) -> List[Cell]:
+    """List the occupied cells overlapping a bounding box.
+
+    Walks whichever is smaller: the cell range covered by the box or the set
+    of occupied cells, so huge viewports cost no more than the grid itself.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = to_cell(min_lon, min_lat)
+    x1, y1 = to_cell(max_lon, max_lat)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(occupied):
+        return [
+            (x, y)
+            for x in range(x0, x1 + 1)
+            for y in range(y0, y1 + 1)
+            if (x, y) in occupied
+        ]
+    return [cell for cell in occupied if x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1]
@@ -0,0 +1,47 @@
+# conftest.py - Fixtures running the app in-process on a throwaway database
+#
+# Usage (from backend/): python -m pytest tests
+
+import importlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+@pytest.fixture(scope="module")
+def app_env() -> dict:
+    """Environment variables set while main is imported; override per test module."""
+    return {}
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory, app_env):
+    """A freshly imported main, working in an empty directory with fountains.csv."""
+    workdir = tmp_path_factory.mktemp("berez")
+    shutil.copy(BACKEND_DIR / "fountains.csv", workdir / "fountains.csv")
+    previous = os.getcwd()
+    os.chdir(workdir)
+    sys.modules.pop("main", None)
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in app_env.items():
+            patch.setenv(name, value)
+        try:
+            yield importlib.import_module("main")
+        finally:
+            sys.modules.pop("main", None)
+            os.chdir(previous)
+
+
+@pytest.fixture(scope="module")
+def client(app_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as test_client:
+        assert test_client.get("/populate").status_code == 200
+        yield test_client
@@ -0,0 +1,33 @@
+# test_fountain_stats.py - Cached fountain totals follow every kind of write
+
+
+def nearest_fountain(client) -> dict:
+    fountain = client.get("/fountains/34.78,32.08?limit=1").json()["items"][0]
+    fountain.pop("distance_m")
+    # Sent by name: the table model takes the value as-is
+    fountain["type"] = "cylindrical_fountain"
+    return fountain
+
+
+def test_stats_follow_status_change_through_put(client):
+    before = client.get("/fountains/stats").json()
+    fountain = nearest_fountain(client)
+    assert fountain["status"] == "verified"
+
+    fountain["status"] = "approved"
+    assert client.put("/fountain", json=fountain).status_code == 200
+
+    after = client.get("/fountains/stats").json()
+    assert after["total"] == before["total"]
+    assert after["by_status"].get("approved", 0) == before["by_status"].get("approved", 0) + 1
+    assert after["by_status"]["verified"] == before["by_status"]["verified"] - 1
+
+
+def test_stats_follow_submitted_fountain(client):
+    before = client.get("/fountains/stats").json()
+    submitted = {"address": "x", "latitude": 32.08, "longitude": 34.78, "type": 3}
+    assert client.post("/fountains/submit", json=submitted).status_code == 201
+
+    after = client.get("/fountains/stats").json()
+    assert after["total"] == before["total"] + 1
+    assert after["by_status"].get("user_submitted", 0) == before["by_status"].get("user_submitted", 0) + 1
@@ -0,0 +1,106 @@
+# test_shards.py - Region shards (DB_SHARDING=region): routing, lazy opening and splitting a core database
+
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+
+
+@pytest.fixture(scope="module")
+def app_env() -> dict:
+    return {"DB_SHARDING": "region", "SHARD_DEGREES": "0.05"}
+
+
+def nearest_fountain(client) -> dict:
+    fountain = client.get("/fountains/34.78,32.08?limit=1").json()["items"][0]
+    fountain.pop("distance_m")
+    fountain["type"] = "cylindrical_fountain"
+    return fountain
+
+
+def test_populate_spreads_fountains_over_region_shards(app_module, client):
+    shards = app_module.shard_set.names()
+    assert len(shards) > 1
+    for name in shards:
+        assert Path(app_module.shard_path(app_module.db_path, name)).exists()
+    assert client.get("/fountains/stats").json()["total"] == 394
+
+
+def test_shards_open_on_first_use(app_module, client):
+    from models import Fountain
+    from shards import ShardSession, ShardSet
+
+    fountain = nearest_fountain(client)
+    opened = []
+
+    def open_shard(name):
+        opened.append(name)
+        return app_module.shard_set.engines(name)
+
+    fresh = ShardSet(app_module.engine, app_module.read_engine, open_shard, 0.05, app_module.row_ids.new_id)
+    fresh.load()
+    with ShardSession(shards=fresh) as session:
+        assert session.get(Fountain, fountain["id"]).address == fountain["address"]
+    assert opened == [fresh.region_of(fountain["longitude"], fountain["latitude"])]
+
+
+def test_reviews_and_photos_follow_their_fountain(client):
+    fountain_id = nearest_fountain(client)["id"]
+    assert client.post("/review", json={"fountain_id": fountain_id, "general_rating": 4}).status_code == 201
+    files = {"file": ("a.jpg", b"\xff\xd8\xff\xe0" + b"0" * 100, "image/jpeg")}
+    photo_id = client.post(f"/photos/upload?fountain_id={fountain_id}", files=files).json()["photo_id"]
+    loose_id = client.post("/photos/upload", files=files).json()["photo_id"]
+
+    detail = client.get(f"/fountains/{fountain_id}/detail").json()
+    assert detail["stats"]["general"]["count"] == 1
+    assert detail["reviews"]["total"] == 1
+    assert detail["photos"]["total"] == 1
+    assert client.get(f"/photos/{photo_id}").json()["fountain_id"] == fountain_id
+    assert client.get(f"/photos/{loose_id}").status_code == 200
+
+
+def test_submitted_fountain_opens_a_new_shard(app_module, client):
+    before = set(app_module.shard_set.names())
+    submitted = {"address": "x", "latitude": 31.5, "longitude": 34.9, "type": 3}
+    response = client.post("/fountains/submit", json=submitted)
+    assert response.status_code == 201
+
+    assert set(app_module.shard_set.names()) - before == {app_module.shard_set.region_of(34.9, 31.5)}
+    fountain_id = response.json()["fountain"]["id"]
+    assert client.get(f"/fountains/{fountain_id}").json()["address"] == "x"
+
+
+def test_stats_follow_status_change_through_put(client):
+    before = client.get("/fountains/stats").json()
+    fountain = nearest_fountain(client)
+    fountain["status"] = "approved"
+    assert client.put("/fountain", json=fountain).status_code == 200
+
+    after = client.get("/fountains/stats").json()
+    assert after["total"] == before["total"]
+    assert after["by_status"].get("approved", 0) == before["by_status"].get("approved", 0) + 1
+
+
+def test_split_core_moves_unsharded_rows(app_module, client):
+    from models import Fountain, FountainType, Review
+    from shards import split_core
+
+    with app_module.engine.begin() as conn:
+        conn.execute(insert(Fountain.__table__), [{
+            "id": 900001, "address": "old", "latitude": 29.55, "longitude": 34.95, "dog_friendly": False,
+            "bottle_refill": False, "type": FountainType.cooler, "average_general_rating": 0.0,
+            "number_of_ratings": 0, "status": "verified",
+        }])
+        conn.execute(insert(Review.__table__), [{"id": 900002, "fountain_id": 900001, "general_rating": 5}])
+
+    moved = split_core(app_module.shard_set, app_module.engine)
+    shard = app_module.shard_set.region_of(34.95, 29.55)
+    assert moved == {shard: 1}
+
+    with app_module.engine.connect() as conn:
+        assert conn.execute(select(Fountain.id)).all() == []
+    shard_engine = create_engine(f"sqlite:///{app_module.shard_path(app_module.db_path, shard)}")
+    with shard_engine.connect() as conn:
+        assert conn.execute(select(Review.fountain_id)).scalars().all() == [900001]
+    shard_engine.dispose()
+    assert client.get("/fountains/900001/detail").json()["reviews"]["total"] == 1
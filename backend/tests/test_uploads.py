@@ -0,0 +1,44 @@
+# test_uploads.py - Oversized uploads are refused before their body is read
+
+
+def test_oversized_upload_is_refused_with_cors_headers(app_module, client):
+    origin = app_module.APP_URL
+    response = client.post(
+        "/photos/upload",
+        content=b"x" * 1024,
+        headers={
+            "Origin": origin,
+            "Content-Type": "multipart/form-data; boundary=x",
+            "Content-Length": str(app_module.MAX_UPLOAD_REQUEST + 1),
+        },
+    )
+    assert response.status_code == 413
+    assert "File too large" in response.json()["detail"]
+    # Browsers only let the page read the message with these
+    assert response.headers["access-control-allow-origin"] == origin
+
+
+def test_abandoned_presigned_uploads_expire(app_module, client, monkeypatch):
+    from datetime import datetime, timedelta
+    from models import Photo
+
+    def presign() -> int:
+        upload = {"filename": "f.jpg", "content_type": "image/jpeg", "file_size": 10}
+        return client.post("/photos/presign", json=upload).json()["photo_id"]
+
+    abandoned, fresh = presign(), presign()
+    with app_module.SessionLocal() as db:
+        photo = db.get(Photo, abandoned)
+        photo.created_at = datetime.now() - timedelta(seconds=app_module.PENDING_PHOTO_TTL + 1)
+        filename = photo.filename
+        db.commit()
+    # Uploaded, but never confirmed
+    stored = app_module.UPLOAD_DIR / filename
+    stored.write_bytes(b"jpeg")
+
+    monkeypatch.setattr(app_module, "_next_pending_sweep", 0.0)
+    presign()
+
+    assert client.get(f"/photos/{abandoned}").status_code == 404
+    assert not stored.exists()
+    assert client.get(f"/photos/{fresh}").json()["status"] == "pending"
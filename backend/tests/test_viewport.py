@@ -0,0 +1,19 @@
+# test_viewport.py - Zoomed-in viewports never drop fountains silently
+
+import pytest
+
+TEL_AVIV = {"min_lon": 34.7, "min_lat": 32.0, "max_lon": 34.9, "max_lat": 32.2, "zoom": 16}
+
+
+@pytest.mark.parametrize("spatial_index", ["memory", "sql"])
+def test_crowded_viewport_falls_back_to_clusters(app_module, client, monkeypatch, spatial_index):
+    monkeypatch.setattr(app_module, "SPATIAL_INDEX", spatial_index)
+    listed = client.get("/fountains/viewport", params=TEL_AVIV).json()
+    assert listed["clustered"] is False
+    count = len(listed["items"])
+    assert count > 10
+
+    monkeypatch.setattr(app_module, "MAX_VIEWPORT_FOUNTAINS", count - 1)
+    crowded = client.get("/fountains/viewport", params=TEL_AVIV).json()
+    assert crowded["clustered"] is True
+    assert sum(cluster["count"] for cluster in crowded["clusters"]) == count
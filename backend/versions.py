@@ -0,0 +1,81 @@
+# versions.py - Data version counters behind HTTP validators (ETag / Last-Modified)
+
+import threading
+import time
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional, Tuple
+
+
+class DataVersions:
+    """Process-local version counters for the data behind read endpoints.
+
+    The global version moves on every committed change to fountains,
+    reviews, photos or reports; each fountain also has its own counter for
+    changes to it and its children. A bulk change that cannot be attributed
+    to single fountains bumps the epoch, which invalidates everything.
+    ETags include a per-process nonce, so validators from another instance
+    or an earlier cold start never match by accident.
+    """
+
+    def __init__(self):
+        self.boot_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._epoch_modified = time.time()
+        self._global = 0
+        self._global_modified = self._epoch_modified
+        self._fountains = {}  # fountain_id -> (version, modified)
+
+    def bump(self, fountain_ids: Iterable[int]):
+        """Record committed changes touching these fountains."""
+        now = time.time()
+        with self._lock:
+            self._global += 1
+            self._global_modified = now
+            for fountain_id in fountain_ids:
+                version, _ = self._fountains.get(fountain_id, (0, now))
+                self._fountains[fountain_id] = (version + 1, now)
+
+    def bump_all(self):
+        """Invalidate every validator after a bulk change."""
+        now = time.time()
+        with self._lock:
+            self._epoch += 1
+            self._epoch_modified = now
+            self._global += 1
+            self._global_modified = now
+            self._fountains.clear()
+
+    def global_validators(self) -> Tuple[str, float]:
+        with self._lock:
+            return f'"{self.boot_id}-{self._epoch}-g{self._global}"', self._global_modified
+
+    def fountain_validators(self, fountain_id: int) -> Tuple[str, float]:
+        with self._lock:
+            version, modified = self._fountains.get(fountain_id, (0, self._epoch_modified))
+            return f'"{self.boot_id}-{self._epoch}-f{fountain_id}.{version}"', modified
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(
+    etag: str,
+    modified: float,
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+) -> bool:
+    """Evaluate conditional request headers; If-None-Match takes precedence."""
+    if if_none_match is not None:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one second resolution
+        return int(modified) <= since
+    return False
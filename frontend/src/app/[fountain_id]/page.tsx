@@ -49,6 +49,9 @@ export default function FountainPage() {
 
     const [currentFountain, setCurrentFountain] = useState<Fountain | null>(null);
     const [reviews, setReviews] = useState<Review[]>([]);
+    const [reviewsTotal, setReviewsTotal] = useState(0);
+    const [reviewsCursor, setReviewsCursor] = useState<string | null>(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
     const [photos, setPhotos] = useState<Photo[]>([]);
     const [isLoading, setIsLoading] = useState(true);
     const [userLocation, setUserLocation] = useState<{ latitude: number; longitude: number } | null>(null);
@@ -92,46 +95,33 @@ export default function FountainPage() {
             const contextFountain = fountains.find(f => f.id === fountain_id);
             if (contextFountain) {
                 setCurrentFountain(contextFountain);
-            } else {
-                // Fetch from API
-                try {
-                    const response = await fetch(`${API_URL}/fountains/${fountain_id}`);
-                    if (response.ok) {
-                        const data = await response.json();
-                        setCurrentFountain(data);
-                    }
-                } catch (error) {
-                    console.error('Error fetching fountain:', error);
-                }
             }
 
-            // Fetch reviews
+            // Fetch fountain, reviews and photos in a single request
             try {
-                const reviewsResponse = await fetch(`${API_URL}/reviews/${fountain_id}`);
-                if (reviewsResponse.ok) {
-                    const reviewsData = await reviewsResponse.json();
-                    const formattedReviews = reviewsData.map((review: Review) => ({
+                const fields = contextFountain ? 'reviews,photos' : 'fountain,reviews,photos';
+                const response = await fetch(`${API_URL}/fountains/${fountain_id}/detail?fields=${fields}`);
+                if (response.ok) {
+                    const data = await response.json();
+                    if (data.fountain) {
+                        setCurrentFountain(data.fountain);
+                    }
+                    setReviews(data.reviews.items.map((review: Review) => ({
                         ...review,
                         creation_date: new Date(review.creation_date),
-                    }));
-                    setReviews(formattedReviews);
-                }
-            } catch (error) {
-                console.error('Error fetching reviews:', error);
-            }
-
-            // Fetch photos
-            try {
-                const photosResponse = await fetch(`${API_URL}/photos/fountain/${fountain_id}`);
-                if (photosResponse.ok) {
-                    const photosData = await photosResponse.json();
-                    setPhotos(photosData.map((p: any) => ({
+                    })));
+                    setReviewsTotal(data.reviews.total);
+                    setReviewsCursor(data.reviews.next_cursor);
+                    setPhotos(data.photos.items.map((p: any) => ({
                         ...p,
                         url: `${API_URL}${p.url}`,
+                        variants: Object.fromEntries(
+                            Object.entries(p.variants || {}).map(([width, url]) => [width, `${API_URL}${url}`])
+                        ),
                     })));
                 }
             } catch (error) {
-                console.error('Error fetching photos:', error);
+                console.error('Error fetching fountain details:', error);
             }
 
             setIsLoading(false);
@@ -162,8 +152,31 @@ export default function FountainPage() {
     };
 
     // Handle new review added
+    // Next page of older reviews, continuing from the detail response's cursor
+    const loadMoreReviews = async () => {
+        if (!reviewsCursor) return;
+        setIsLoadingMore(true);
+        try {
+            const response = await fetch(
+                `${API_URL}/reviews/${fountain_id}?cursor=${encodeURIComponent(reviewsCursor)}`
+            );
+            if (response.ok) {
+                const page: Review[] = await response.json();
+                setReviews(prev => [
+                    ...prev,
+                    ...page.map(review => ({ ...review, creation_date: new Date(review.creation_date) })),
+                ]);
+                setReviewsCursor(response.headers.get('X-Next-Cursor'));
+            }
+        } catch (error) {
+            console.error('Error fetching more reviews:', error);
+        }
+        setIsLoadingMore(false);
+    };
+
     const handleReviewAdded = (newReview: Review) => {
         setReviews(prev => [newReview, ...prev]);
+        setReviewsTotal(prev => prev + 1);
         setShowReviewForm(false);
         
         // Update fountain rating in state
@@ -288,7 +301,7 @@ export default function FountainPage() {
                     </h2>
                     {reviews.length > 0 && (
                         <span className="text-gray-500 text-sm">
-                            {reviews.length} ביקורות
+                            {reviewsTotal} ביקורות
                         </span>
                     )}
                 </div>
@@ -303,6 +316,15 @@ export default function FountainPage() {
                         {reviews.map((review) => (
                             <ReviewCard key={review.id} review={review} />
                         ))}
+                        {reviewsCursor && (
+                            <button
+                                onClick={loadMoreReviews}
+                                disabled={isLoadingMore}
+                                className="w-full py-3 text-sm font-medium text-blue-600 disabled:text-gray-400"
+                            >
+                                {isLoadingMore ? 'טוען...' : 'טען עוד ביקורות'}
+                            </button>
+                        )}
                     </div>
                 )}
             </div>
@@ -43,6 +43,7 @@ export type Photo = {
     id: number;
     url: string;
     original_filename: string;
+    variants?: Record<string, string>; // width in px -> resized image URL
 };
 
 export type ReviewCreate = {
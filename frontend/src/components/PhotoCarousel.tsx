@@ -6,6 +6,14 @@ import useEmblaCarousel from 'embla-carousel-react';
 interface Photo {
     id: number;
     url: string;
+    variants?: Record<string, string>;
+}
+
+// "url 320w, url 640w, ..." from the resized variants, if any were generated
+function srcSetFor(photo: Photo): string | undefined {
+    const entries = Object.entries(photo.variants || {});
+    if (entries.length === 0) return undefined;
+    return entries.map(([width, url]) => `${url} ${width}w`).join(', ');
 }
 
 interface PhotoCarouselProps {
@@ -76,6 +84,8 @@ export default function PhotoCarousel({
             >
                 <img
                     src={photos[0].url}
+                    srcSet={srcSetFor(photos[0])}
+                    sizes="(max-width: 768px) 100vw, 768px"
                     alt="תמונת הברזייה"
                     className="w-full h-full object-cover"
                 />
@@ -104,6 +114,8 @@ export default function PhotoCarousel({
                         >
                             <img
                                 src={photo.url}
+                                srcSet={srcSetFor(photo)}
+                                sizes="(max-width: 768px) 100vw, 768px"
                                 alt={`תמונה ${index + 1}`}
                                 className="w-full h-full object-cover"
                                 loading={index === 0 ? 'eager' : 'lazy'}
@@ -192,6 +204,8 @@ function FullscreenModal({ photo, onClose }: { photo: Photo; onClose: () => void
             </button>
             <img
                 src={photo.url}
+                srcSet={srcSetFor(photo)}
+                sizes="100vw"
                 alt="תמונה בגודל מלא"
                 className="max-w-full max-h-full object-contain"
                 onClick={(e) => e.stopPropagation()}
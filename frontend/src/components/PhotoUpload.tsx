@@ -51,23 +51,51 @@ export default function PhotoUpload({
             }
 
             try {
-                const formData = new FormData();
-                formData.append('file', file);
-                if (fountainId) {
-                    formData.append('fountain_id', fountainId.toString());
-                }
-
-                const headers: HeadersInit = {};
+                const headers: HeadersInit = { 'Content-Type': 'application/json' };
                 if (token) {
                     headers['Authorization'] = `Bearer ${token}`;
                 }
 
-                const response = await fetch(`${API_URL}/photos/upload`, {
+                // 1. Reserve the photo and get a direct-to-storage upload URL
+                const presignResponse = await fetch(`${API_URL}/photos/presign`, {
                     method: 'POST',
                     headers,
+                    body: JSON.stringify({
+                        filename: file.name,
+                        content_type: file.type,
+                        file_size: file.size,
+                        fountain_id: fountainId ?? null,
+                    }),
+                });
+
+                if (!presignResponse.ok) {
+                    const errorData = await presignResponse.json();
+                    throw new Error(errorData.detail || 'שגיאה בהעלאת התמונה');
+                }
+
+                const { photo_id, upload } = await presignResponse.json();
+
+                // 2. Send the file straight to storage, bypassing the API
+                const formData = new FormData();
+                Object.entries(upload.fields as Record<string, string>).forEach(([key, value]) => {
+                    formData.append(key, value);
+                });
+                formData.append('file', file);
+
+                const uploadResponse = await fetch(upload.url, {
+                    method: upload.method,
                     body: formData,
                 });
 
+                if (!uploadResponse.ok) {
+                    throw new Error('שגיאה בהעלאת התמונה');
+                }
+
+                // 3. Tell the API the file is in place
+                const response = await fetch(`${API_URL}/photos/${photo_id}/confirm`, {
+                    method: 'POST',
+                });
+
                 if (!response.ok) {
                     const errorData = await response.json();
                     throw new Error(errorData.detail || 'שגיאה בהעלאת התמונה');